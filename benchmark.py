@@ -0,0 +1,277 @@
+"""
+Benchmarks the Origin scripts (master_sheets.py, renaming.py, extract.py) without Origin,
+on a synthetic project held by fake_pyorigin.
+
+Every scenario runs a script on each folder of a fresh project twice: 'first' does all the work,
+'rerun' measures what is left when nothing changed (existing masters, Note cache...).
+The wall time and the number of calls to every PyOrigin function are reported, the calls being what costs
+in Origin (use --latency to give them a price).
+
+usage:
+	python benchmark.py                                   (default project, all scenarios)
+	python benchmark.py --pages 100 --latency 0.2 automatic batch
+	python benchmark.py --save calls.json                 (keep the results as a reference)
+	python benchmark.py --compare calls.json              (exit status 1 if a scenario makes more calls)
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import math
+import os
+import random
+import runpy
+import sys
+import tempfile
+import time
+from collections import Counter, namedtuple
+from datetime import datetime, timedelta
+from typing import Dict, List
+import fake_pyorigin
+fake_pyorigin.install() # before anything imports PyOrigin
+from fluor_essence_xml import TEMPLATE_FILES, ExperimentType, ExperimentXML
+from master_sheets import BATCH_LAYER_NAME, NORMAL_LAYER_NAME
+from note_parser import NoteRecord, build_long_name
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+Scenario = namedtuple('Scenario', [
+	'script',
+	'argv',
+	'folders', # 'data', 'batch', 'all', or 'root' (a single run, for the whole-project mode)
+])
+
+SCENARIOS = {
+	'automatic'   : Scenario('master_sheets.py', [],                  'data'),
+	'interactive' : Scenario('master_sheets.py', ['400', 'Emission'], 'data'),
+	'titration'   : Scenario('master_sheets.py', ['titration'],       'data'),
+	'batch'       : Scenario('master_sheets.py', ['titration'],       'batch'),
+	'renaming'    : Scenario('renaming.py',      [],                  'all'),
+	'extract'     : Scenario('extract.py',       [],                  'all'),
+	'project'     : Scenario('master_sheets.py', ['titration', '--project'], 'root'),
+	'rename-master' : Scenario('rename_and_master.py', [],            'data'),
+	'renaming-project' : Scenario('renaming.py', ['--project'],       'root'),
+}
+
+RUNS = ('first', 'rerun')
+
+# FluorEssence only writes the first detector in the templates, the Notes of the instrument have both
+SCD2 = '<SCD2 darkEnabled="-1" blankEnabled="0" blankFile="" correctionEnabled="0" />'
+
+
+
+def make_note(record : NoteRecord, templates : dict) -> str:
+	"""
+	A Note as FluorEssence writes it: parameter lines, then the experiment file on a single line.
+	"""
+	exp_type = ExperimentType(record.experiment_type)
+	xml = templates[exp_type].render(
+		ex_slit          = record.excitation_slit,
+		em_slit          = record.emission_slit,
+		park             = int(record.park),
+		start_wavelength = int(record.range[0]),
+		end_wavelength   = int(record.range[1]),
+		integration_time = record.integration_time,
+	)
+	xml = ''.join(line.strip() for line in xml.splitlines()).replace('</Correction>', SCD2 + '</Correction>')
+
+	lines = [
+		'Sample: benchmark',
+		'Experiment Type: Spectral Acquisition[%s]' % record.experiment_type,
+		'Integration Time: %gs' % record.integration_time,
+		'Park: %dnm' % record.park,
+		'EX1: Excitation 1',
+		'Side Entrance Slit: %g nmBandpass' % record.excitation_slit,
+		'Side Exit Slit: %g nmBandpass' % record.excitation_slit,
+		'EM1: Emission 1',
+		'Side Entrance Slit: %g nmBandpass' % record.emission_slit,
+		'Side Exit Slit: %g nmBandpass' % record.emission_slit,
+		'[EXP_FILE]',
+		xml,
+	]
+	return '\r\n'.join(lines) + '\r\n'
+
+
+
+def spectrum(start : int, end : int, center : float, width : float, scale : float) -> list:
+	return [scale * math.exp(-((x - center) / width) ** 2) + 100.0 for x in range(start, end + 1)]
+
+
+
+def add_spectrum_page(folder, name : str, record : NoteRecord, columns : int, created : datetime, templates : dict, batch : bool):
+	start, end = int(record.range[0]), int(record.range[1])
+	long_name = build_long_name(folder.name, record)
+	page = folder.add_page(name, long_name, created)
+
+	layer = page.add_layer(BATCH_LAYER_NAME if batch else NORMAL_LAYER_NAME)
+	layer.add_column('A', 'Wavelength', list(range(start, end + 1))).type = fake_pyorigin.COLTYPE_DESIGN_X
+	for i in range(columns):
+		center = (start + end) / 2 + 3 * i
+		layer.add_column(layer.column_name(), long_name, spectrum(start, end, center, 25.0, 1e5 / (1 + i)), comments = 'S1c %d' % (i + 1))
+
+	note = page.add_layer('Note')
+	note.add_column('A', 'Note', [make_note(record, templates)])
+	return page
+
+
+
+def build_project(args : argparse.Namespace, directory : str) -> Dict[str, list]:
+	"""
+	Fills a new fake project, returns its folders by kind ('data', 'batch').
+	"""
+	project = fake_pyorigin.install(fake_pyorigin.Project(directory, 'benchmark'))
+	templates = {exp_type : ExperimentXML(os.path.join(HERE, filename), exp_type).compile() for exp_type, filename in TEMPLATE_FILES.items()}
+	rng = random.Random(args.seed)
+	created = datetime(2023, 6, 14, 7, 44)
+	pages_count = 0
+
+	def next_page_name() -> str:
+		nonlocal pages_count
+		pages_count += 1
+		return 'Book%d' % pages_count
+
+	def next_date() -> datetime:
+		return created + timedelta(minutes = rng.randrange(100000))
+
+	folders = {'data' : [], 'batch' : []}
+
+	for i in range(args.folders):
+		folder = project.root.add_folder('S%02d_DCM_data' % i)
+		folders['data'].append(folder)
+		for j in range(args.pages):
+			exp_type = 'Emission' if j % 2 == 0 else 'Excitation'
+			park = 300 + 2 * j
+			start = 200 + 5 * (j % 4)
+			end = min(start + args.points - 1, 1000)
+			record = NoteRecord(exp_type, park, 2.0, 1.5 if j % 3 else 2.0, 0.1, {}, (start, end))
+			add_spectrum_page(folder, next_page_name(), record, 1, next_date(), templates, batch = False)
+
+	for i in range(args.batch_folders):
+		folder = project.root.add_folder('T%02d_MeCN_titr' % i)
+		folders['batch'].append(folder)
+		for j in range(args.pages):
+			record = NoteRecord('Emission', 350 + j, 2.0, 2.0, 0.1, {}, (360, min(360 + args.points - 1, 1000)))
+			add_spectrum_page(folder, next_page_name(), record, args.columns, next_date(), templates, batch = True)
+
+	# unrelated pages in the root folder, scanned when the MasterIndex has to be rebuilt
+	for i in range(args.root_pages):
+		type_ = fake_pyorigin.PGTYPE_GRAPH if i % 3 else fake_pyorigin.PGTYPE_WKS
+		page = project.root.add_page('Junk%d' % i, 'unrelated %d' % i, next_date(), type_)
+		if type_ == fake_pyorigin.PGTYPE_WKS:
+			page.add_layer('Sheet1').add_column('A', '', list(range(10)))
+
+	return folders
+
+
+
+def run_script(script : str, argv : List[str], show_output : bool) -> None:
+	sys.argv = [script] + argv
+	output = contextlib.nullcontext() if show_output else contextlib.redirect_stdout(io.StringIO())
+	with output:
+		runpy.run_path(os.path.join(HERE, script), run_name = '__main__')
+
+
+
+def run_scenario(name : str, args : argparse.Namespace) -> dict:
+	scenario = SCENARIOS[name]
+	results = {}
+
+	with tempfile.TemporaryDirectory() as directory:
+		folders = build_project(args, directory)
+		folders['all'] = folders['data'] + folders['batch']
+		folders['root'] = [fake_pyorigin.PROJECT.root]
+		targets = folders[scenario.folders]
+
+		for run in RUNS:
+			fake_pyorigin.reset_counters()
+			start = time.perf_counter()
+			for folder in targets:
+				fake_pyorigin.PROJECT.active = folder
+				run_script(scenario.script, scenario.argv, args.show_output)
+			seconds = time.perf_counter() - start
+			results[run] = {'seconds' : seconds, 'calls' : dict(fake_pyorigin.CALLS)}
+
+	return results
+
+
+
+def print_report(results : dict, top : int) -> None:
+	print('%-12s %-6s %9s %8s   %s' % ('scenario', 'run', 'time (s)', 'calls', 'most called'))
+	print('-' * 100)
+	for name, runs in results.items():
+		for run, result in runs.items():
+			calls = Counter(result['calls'])
+			most_called = ', '.join('%s %d' % item for item in calls.most_common(top))
+			print('%-12s %-6s %9.3f %8d   %s' % (name, run, result['seconds'], sum(calls.values()), most_called))
+
+
+
+def compare(results : dict, reference : dict) -> bool:
+	"""
+	Prints the API calls that increased since the reference, returns whether there are none.
+	"""
+	ok = True
+	for name, runs in results.items():
+		for run, result in runs.items():
+			if run not in reference.get(name, {}):
+				continue
+			before = reference[name][run]
+			for api in sorted(set(result['calls']) | set(before['calls'])):
+				(old, new) = (before['calls'].get(api, 0), result['calls'].get(api, 0))
+				if new > old:
+					print('REGRESSION %s/%s: %s %d -> %d calls' % (name, run, api, old, new))
+					ok = False
+			print('%-12s %-6s calls %6d -> %6d   time %.3f -> %.3f s' % (
+				name, run, sum(before['calls'].values()), sum(result['calls'].values()), before['seconds'], result['seconds'])
+			)
+	return ok
+
+
+
+def parse_arguments() -> argparse.Namespace:
+	parser = argparse.ArgumentParser(description = 'Benchmarks the Origin scripts on a synthetic project.')
+	parser.add_argument('scenarios', nargs = '*', metavar = 'scenario', help = '%s (default: all of them)' % ', '.join(SCENARIOS))
+	parser.add_argument('--folders', type = int, default = 4, help = 'folders of single spectra (default: 4)')
+	parser.add_argument('--batch-folders', type = int, default = 2, help = 'folders of multi-column spectra (default: 2)')
+	parser.add_argument('--pages', type = int, default = 20, help = 'worksheets per folder (default: 20)')
+	parser.add_argument('--columns', type = int, default = 10, help = 'Y columns per batch worksheet (default: 10)')
+	parser.add_argument('--points', type = int, default = 601, help = 'points per spectrum (default: 601)')
+	parser.add_argument('--root-pages', type = int, default = 200, help = 'unrelated pages in the root folder (default: 200)')
+	parser.add_argument('--latency', type = float, default = 0.0, help = 'seconds added to every PyOrigin call')
+	parser.add_argument('--seed', type = int, default = 0)
+	parser.add_argument('--top', type = int, default = 4, help = 'most called functions to show (default: 4)')
+	parser.add_argument('--show-output', action = 'store_true', help = 'do not hide the output of the scripts')
+	parser.add_argument('--save', metavar = 'FILE', help = 'save the results as JSON')
+	parser.add_argument('--compare', metavar = 'FILE', help = 'compare the call counts with results saved by --save')
+
+	args = parser.parse_args()
+	for name in args.scenarios:
+		if name not in SCENARIOS:
+			parser.error('unknown scenario: ' + name)
+	return args
+
+
+
+def main():
+	args = parse_arguments()
+	fake_pyorigin.LATENCY = args.latency
+
+	results = {name : run_scenario(name, args) for name in (args.scenarios or SCENARIOS)}
+	print_report(results, args.top)
+
+	if args.save:
+		with open(args.save, mode = 'w') as f:
+			json.dump(results, f, indent = '\t')
+
+	if args.compare:
+		print()
+		with open(args.compare) as f:
+			reference = json.load(f)
+		if not compare(results, reference):
+			sys.exit(1)
+
+
+
+if __name__ == '__main__':
+	main()
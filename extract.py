@@ -1,19 +1,51 @@
+import csv
+import sys
+from typing import List, Tuple
 import PyOrigin
-import os
-import xml.etree.ElementTree as ET
-import re
+from note_cache import NoteCache, project_file_path
+from note_parser import Correction
+from master_sheets import PROJECT_OPTION, walk_folders
 
-def get_xml(text : str):
-	print(text)
-	lines = text.split('\r\n')
-	idx = lines.index('[EXP_FILE]')
-	print(lines)
+# --audit: every folder of the project, the correction settings of every worksheet are saved as a CSV table
+# (next to the project: MyProject.opju -> MyProject.audit.csv, or --audit=C:\path\to\audit.csv)
+AUDIT_OPTION = '--audit'
+AUDIT_SUFFIX = '.audit.csv'
 
-	xml = ET.fromstring(lines[idx + 1])
-	ET.indent(xml, space='\t')
-	return xml
+DETECTORS = ('SCD1', 'SCD2')
+AUDIT_COLUMNS = ['folder', 'page', 'long_name'] + [
+	'%s_%s' % (detector, field) for detector in DETECTORS for field in Correction._fields
+] + ['problems']
 
-def extract_folder(folder : PyOrigin.CPyFolder) -> None:
+# settings that should be enabled before the data is published
+REQUIRED_SETTINGS = ('dark', 'correction')
+
+
+
+def audit_problems(correction : dict) -> List[str]:
+	"""
+	The missing or disabled dark and correction settings of the detectors.
+	"""
+	problems = []
+	for detector in DETECTORS:
+		if detector not in correction:
+			problems.append('no %s' % detector)
+			continue
+		for field in REQUIRED_SETTINGS:
+			value = getattr(correction[detector], field)
+			if value is None:
+				problems.append('%s %s missing' % (detector, field))
+			elif value == '0':
+				problems.append('%s %s disabled' % (detector, field))
+	return problems
+
+
+
+def extract_folder(folder : PyOrigin.CPyFolder, path : str, cache : NoteCache, rows : List[list]) -> Tuple[int, int]:
+	"""
+	Prints the correction settings of the worksheets of the folder (whose path is path)
+	and adds them to rows (see AUDIT_COLUMNS), returns (number of worksheets read, number of ill-formed Notes)
+	"""
+	(read, ill_formed) = (0, 0)
 	for pagebase in folder.PageBases():
 		if pagebase.Type != PyOrigin.PGTYPE_WKS: # ignore non-worksheets
 			continue
@@ -27,28 +59,74 @@ def extract_folder(folder : PyOrigin.CPyFolder) -> None:
 		note = PyOrigin.Pages(short_name).Layers('Note')
 		if note is None:
 			print('this page does not have a Note sheet')
+			rows.append([path, short_name, long_name] + [''] * len(DETECTORS) * len(Correction._fields) + ['no Note'])
 			continue
 
 		text = note.Columns(0).GetData()[0]
 # <SCD1 darkEnabled="1" blankEnabled="0" blankFile="" correctionEnabled="0"/>
 # <SCD2 darkEnabled="1" blankEnabled="0" blankFile="" correctionEnabled="0"/></Correction>
-		try:
-			sdc1 = re.search('(SCD1) (darkEnabled="-?\d+") blankEnabled="0" blankFile="" (correctionEnabled="-?\d+")', text).groups()
-			sdc2 = re.search('(SCD2) (darkEnabled="-?\d+") blankEnabled="0" blankFile="" (correctionEnabled="-?\d+")', text).groups()
+		(_, record) = cache.parse(text)
+		correction = record.correction
+		read += 1
+
+		settings = []
+		for detector in DETECTORS:
+			settings += correction[detector] if detector in correction else [''] * len(Correction._fields)
+		rows.append([path, short_name, long_name] + settings + ['; '.join(audit_problems(correction))])
 
-			print('%s has %s %s %s     and    %s %s %s' % (long_name, sdc1[0], sdc1[1], sdc1[2], sdc2[0], sdc2[1], sdc2[2]))
-		except AttributeError:
+		try:
+			sdc1, sdc2 = correction['SCD1'], correction['SCD2']
+		except KeyError:
 			print('%s is ill-formed' % long_name)
+			ill_formed += 1
+			continue
+
+		print('%s has SCD1 darkEnabled="%s" blankEnabled="%s" correctionEnabled="%s"     and    SCD2 darkEnabled="%s" blankEnabled="%s" correctionEnabled="%s"' %
+			(long_name, sdc1.dark, sdc1.blank, sdc1.correction, sdc2.dark, sdc2.blank, sdc2.correction)
+		)
+
+	return (read, ill_formed)
+
+
+
+def write_audit(path : str, rows : List[list]) -> None:
+	with open(path, mode = 'w', newline = '') as f:
+		writer = csv.writer(f)
+		writer.writerow(AUDIT_COLUMNS)
+		writer.writerows(rows)
+
 
 
 
+def main(arguments : List[str]):
+	# --project: every folder of the project instead of the active one, --audit implies it
+	audit = next((argument for argument in arguments if argument.startswith(AUDIT_OPTION)), None)
+	project = PROJECT_OPTION in arguments or audit is not None
+	folders = walk_folders(PyOrigin.GetRootFolder()) if project else [PyOrigin.ActiveFolder()]
 
+	cache = NoteCache.for_project()
+	summary = []
+	rows = []
+	for folder in folders:
+		path = folder.Path()
+		print('\n\ncurrent folder: ' + path + '\n\n')
+		summary.append((path, extract_folder(folder, path, cache, rows)))
+	cache.save()
 
-def main():
-	folder = PyOrigin.ActiveFolder()
+	if project:
+		print('\n\nsummary: %d folders' % len(summary))
+		for path, (read, ill_formed) in summary:
+			print('%-40s %d worksheets, %d ill-formed Notes' % (path, read, ill_formed))
 
-	print('\n\ncurrent folder: ' + folder.Path() + '\n\n')
-	extract_folder(folder)
+	if audit is not None:
+		audit_path = audit.partition('=')[2] or project_file_path(AUDIT_SUFFIX)
+		if audit_path is None:
+			print('the project was never saved, give the path of the table: %s=C:\\path\\to\\audit.csv' % AUDIT_OPTION)
+			return
+		write_audit(audit_path, rows)
+		print('\n%d worksheets audited, %d with problems, saved to %s' %
+			(len(rows), sum(row[-1] != '' for row in rows), audit_path)
+		)
 
 if __name__ == '__main__':
-	main()
\ No newline at end of file
+	main(sys.argv[1:])
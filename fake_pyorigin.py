@@ -0,0 +1,472 @@
+"""
+In-memory stand-in for the PyOrigin module, implementing the subset used by the scripts of this repository
+(see benchmark.py). Every API call is counted in CALLS, and can be slowed down by LATENCY seconds
+to mimic the cost of a round trip to Origin.
+
+	import fake_pyorigin
+	project = fake_pyorigin.install()      # from now on, 'import PyOrigin' returns this module
+	folder = project.root.add_folder('TN76_DCM')
+	page = folder.add_page('Book1', 'TN76_DCM_350_2_1_0.1', datetime(2023, 6, 14, 7, 44))
+	layer = page.add_layer('Data')
+	layer.add_column('A', long_name = 'Wavelength', data = [...])
+"""
+
+import re
+import sys
+import time
+from collections import Counter
+from datetime import datetime
+from functools import wraps
+from typing import Dict, List, Optional
+
+PGTYPE_WKS    = 2
+PGTYPE_GRAPH  = 3
+PGTYPE_MATRIX = 5
+
+COLTYPE_DESIGN_Y     = 0
+COLTYPE_DESIGN_NONE  = 1
+COLTYPE_DESIGN_Y_ERR = 2
+COLTYPE_DESIGN_X     = 3
+
+LABEL_LONG_NAME = 0
+LABEL_UNITS     = 1
+LABEL_COMMENTS  = 2
+
+CALLS : Counter = Counter() # 'CPyColumn.GetData' -> number of calls
+LATENCY = 0.0               # seconds added to every call
+PROJECT : Optional['Project'] = None
+
+DATE_FORMAT = '%d/%m/%Y %H:%M' # format of the creation dates returned by the OriginC get_creation_date()
+
+
+
+def api(function):
+	"""
+	Counts the calls to a PyOrigin function, and adds the latency.
+	"""
+	name = function.__qualname__
+
+	@wraps(function)
+	def wrapper(*args, **kwargs):
+		CALLS[name] += 1
+		if LATENCY:
+			time.sleep(LATENCY)
+		return function(*args, **kwargs)
+
+	return wrapper
+
+
+
+def reset_counters() -> None:
+	CALLS.clear()
+
+
+
+class CPyOriginCollectionBase(list):
+	pass
+
+
+
+class CPyColumn:
+	def __init__(self, name : str, long_name : str = '', data : Optional[list] = None) -> None:
+		self.name = name
+		self.long_name = long_name
+		self.comments = ''
+		self.units = ''
+		self.type = COLTYPE_DESIGN_Y
+		self.params : Dict[str, str] = {} # user parameter rows ('D1', 'D2', ...)
+		self.data = list(data) if data is not None else []
+
+	@api
+	def GetName(self) -> str:
+		return self.name
+
+	@api
+	def GetLongName(self) -> str:
+		return self.long_name
+
+	@api
+	def SetLongName(self, long_name : str) -> None:
+		self.long_name = long_name
+
+	@api
+	def GetComments(self) -> str:
+		return self.comments
+
+	@api
+	def SetComments(self, comments : str) -> None:
+		self.comments = comments
+
+	@api
+	def GetUnits(self) -> str:
+		return self.units
+
+	@api
+	def SetUnits(self, units : str) -> None:
+		self.units = units
+
+	@api
+	def GetType(self) -> int:
+		return self.type
+
+	@api
+	def SetType(self, type_ : int) -> None:
+		self.type = type_
+
+	@api
+	def GetData(self, start : int = 0, end : int = -1) -> list:
+		return self.data[start:] if end == -1 else self.data[start : end + 1]
+
+	@api
+	def SetData(self, data, start : int = 0) -> None:
+		data = list(data)
+		head = self.data[:start] + [''] * (start - len(self.data))
+		self.data = head + data
+
+
+
+LABEL_ATTRIBUTES = {'L' : 'long_name', 'U' : 'units', 'C' : 'comments'}
+
+class CPyWorksheet:
+	def __init__(self, name : str, page : 'CPyWorksheetPage') -> None:
+		self.name = name
+		self.page = page
+		self.columns : List[CPyColumn] = []
+		self.visible_labels = set()
+		self.user_params : Dict[int, str] = {} # shown user parameter rows -> their name
+
+	def add_column(self, name : str, long_name : str = '', data : Optional[list] = None, comments : str = '') -> CPyColumn:
+		column = CPyColumn(name, long_name, data)
+		column.comments = comments
+		self.columns.append(column)
+		return column
+
+	def column_name(self) -> str:
+		index = len(self.columns)
+		name = ''
+		while True:
+			name = chr(ord('A') + index % 26) + name
+			index = index // 26 - 1
+			if index < 0:
+				return name
+
+	@api
+	def GetName(self) -> str:
+		return self.name
+
+	@api
+	def SetName(self, name : str) -> None:
+		self.name = name
+
+	@api
+	def GetPage(self) -> 'CPyWorksheetPage':
+		return self.page
+
+	@api
+	def GetColCount(self) -> int:
+		return len(self.columns)
+
+	@api
+	def SetColCount(self, count : int) -> None:
+		while len(self.columns) < count:
+			self.columns.append(CPyColumn(self.column_name()))
+		del self.columns[count:]
+
+	@api
+	def InsertCol(self, index : int, name : str) -> None:
+		self.columns.insert(index, CPyColumn(name))
+
+	@api
+	def DeleteCol(self, index : int) -> None:
+		del self.columns[index]
+
+	@api
+	def Columns(self, key = None):
+		if key is None:
+			return CPyOriginCollectionBase(self.columns)
+		if isinstance(key, str):
+			return next((column for column in self.columns if column.name == key), None)
+		return self.columns[key] if 0 <= key < len(self.columns) else None
+
+	@api
+	def GetLabels(self, type_ : str) -> list:
+		if type_ in LABEL_ATTRIBUTES:
+			return [getattr(column, LABEL_ATTRIBUTES[type_]) for column in self.columns]
+		return [column.params.get(type_, '') for column in self.columns]
+
+	@api
+	def SetLabels(self, labels : list, type_ : str, offset : int = 0) -> None:
+		for column, label in zip(self.columns[offset:], labels):
+			if type_ in LABEL_ATTRIBUTES:
+				setattr(column, LABEL_ATTRIBUTES[type_], label)
+			else:
+				column.params[type_] = label
+
+	@api
+	def SetColDesignations(self, designations : str, start : int = 0, repeat : bool = True) -> None:
+		types = {'X' : COLTYPE_DESIGN_X, 'Y' : COLTYPE_DESIGN_Y, 'N' : COLTYPE_DESIGN_NONE, 'E' : COLTYPE_DESIGN_Y_ERR}
+		for column, designation in zip(self.columns[start:], designations):
+			column.type = types[designation]
+
+	@api
+	def GetData(self, row_start : int = 0, col_start : int = 0, row_end : int = -1, col_end : int = -1) -> list:
+		columns = self.columns[col_start:] if col_end == -1 else self.columns[col_start : col_end + 1]
+		return [column.data[row_start:] if row_end == -1 else column.data[row_start : row_end + 1] for column in columns]
+
+	@api
+	def SetData(self, data : list, row : int = 0, col : int = 0) -> None:
+		"""
+		data is a list of columns
+		"""
+		for column, values in zip(self.columns[col:], data):
+			head = column.data[:row] + [''] * (row - len(column.data))
+			column.data = head + list(values)
+
+	@api
+	def SetLabelVisible(self, label : int, visible : bool = True) -> None:
+		if visible:
+			self.visible_labels.add(label)
+		else:
+			self.visible_labels.discard(label)
+
+
+
+class CPyPageBase:
+	def __init__(self, name : str, long_name : str, type_ : int, created : datetime) -> None:
+		self.name = name
+		self.long_name = long_name
+		self.Type = type_
+		self.created = created
+		self.hidden = False
+		self.layers : List[CPyWorksheet] = []
+		self.folder : Optional['CPyFolder'] = None
+
+	def add_layer(self, name : str) -> CPyWorksheet:
+		layer = CPyWorksheet(name, self)
+		self.layers.append(layer)
+		return layer
+
+	@api
+	def GetName(self) -> str:
+		return self.name
+
+	@api
+	def GetLongName(self) -> str:
+		return self.long_name
+
+	@api
+	def SetLongName(self, long_name : str) -> None:
+		self.long_name = long_name
+
+	@api
+	def Layers(self, key = None):
+		if key is None:
+			return CPyOriginCollectionBase(self.layers)
+		if isinstance(key, str):
+			return next((layer for layer in self.layers if layer.name == key), None)
+		return self.layers[key] if 0 <= key < len(self.layers) else None
+
+CPyWorksheetPage = CPyPageBase
+
+
+
+class CPyFolder:
+	def __init__(self, name : str, parent : Optional['CPyFolder'] = None) -> None:
+		self.name = name
+		self.parent = parent
+		self.pages : List[CPyPageBase] = []
+		self.folders : List['CPyFolder'] = []
+
+	def add_folder(self, name : str) -> 'CPyFolder':
+		folder = CPyFolder(name, self)
+		self.folders.append(folder)
+		return folder
+
+	def add_page(self, name : str, long_name : str, created : datetime, type_ : int = PGTYPE_WKS) -> CPyPageBase:
+		page = CPyPageBase(name, long_name, type_, created)
+		PROJECT.register(page, self)
+		return page
+
+	def path(self) -> str:
+		return '/' if self.parent is None else self.parent.path() + self.name + '/'
+
+	@api
+	def GetName(self) -> str:
+		return self.name
+
+	@api
+	def Path(self) -> str:
+		return self.path()
+
+	@api
+	def PageBases(self) -> CPyOriginCollectionBase:
+		return CPyOriginCollectionBase(self.pages)
+
+	@api
+	def Folders(self) -> CPyOriginCollectionBase:
+		return CPyOriginCollectionBase(self.folders)
+
+
+
+class Project:
+	"""
+	The state behind the module functions.
+	directory and name are what LabTalk's %X and %G expand to, an empty name means an unsaved project.
+	"""
+	def __init__(self, directory : str = '', name : str = '') -> None:
+		self.root = CPyFolder('')
+		self.active = self.root
+		self.pages : Dict[str, CPyPageBase] = {}
+		self.variables : Dict[str, str] = {}
+		self.directory = directory
+		self.name = name
+		self.clock = datetime(2030, 1, 1)
+
+	def register(self, page : CPyPageBase, folder : CPyFolder) -> None:
+		if page.name in self.pages:
+			raise ValueError('a page named %s already exists' % page.name)
+		page.folder = folder
+		folder.pages.append(page)
+		self.pages[page.name] = page
+
+	def unique_name(self, name : str) -> str:
+		# short names lose their special characters and are truncated to 12 characters
+		name = re.sub('[^A-Za-z0-9]', '', name)[:12] or 'Book'
+		candidate, i = name, 1
+		while candidate in self.pages:
+			candidate = name[:12 - len(str(i))] + str(i)
+			i += 1
+		return candidate
+
+	def folder(self, path : str) -> Optional[CPyFolder]:
+		folder = self.root
+		for name in (part for part in path.split('/') if part != ''):
+			folder = next((child for child in folder.folders if child.name == name), None)
+			if folder is None:
+				return None
+		return folder
+
+
+
+def install(project : Optional[Project] = None) -> Project:
+	"""
+	Makes 'import PyOrigin' return this module, working on project (a new empty one by default).
+	"""
+	global PROJECT
+	PROJECT = project if project is not None else Project()
+	sys.modules['PyOrigin'] = sys.modules[__name__]
+	return PROJECT
+
+
+
+@api
+def ActiveFolder() -> CPyFolder:
+	return PROJECT.active
+
+@api
+def GetRootFolder() -> CPyFolder:
+	return PROJECT.root
+
+@api
+def Pages(name : str) -> Optional[CPyPageBase]:
+	return PROJECT.pages.get(name)
+
+@api
+def CreatePage(type_ : int, name : str, template : str, option : int) -> CPyPageBase:
+	PROJECT.clock = PROJECT.clock.replace(minute = (PROJECT.clock.minute + 1) % 60)
+	page = CPyPageBase(PROJECT.unique_name(name), '', type_, PROJECT.clock)
+	PROJECT.register(page, PROJECT.active)
+	if type_ == PGTYPE_WKS:
+		page.add_layer('Sheet1')
+	return page
+
+@api
+def XF(name : str, arguments : dict) -> None:
+	if name == 'pe_cd':
+		folder = PROJECT.folder(arguments['path'])
+		if folder is not None:
+			PROJECT.active = folder
+	else:
+		raise NotImplementedError('X-Function %s' % name)
+
+@api
+def LT_get_str(name : str) -> str:
+	return PROJECT.variables.get(name, '')
+
+@api
+def LT_execute(script : str) -> None:
+	for statement in (statement.strip() for statement in script.split(';')):
+		if statement != '':
+			run_labtalk(statement)
+
+
+
+# the OriginC functions of rename_files.c that the scripts call from LabTalk
+
+def get_creation_date(short_name : str) -> str:
+	page = PROJECT.pages.get(short_name)
+	return page.created.strftime(DATE_FORMAT) if page is not None else 'PAGE_ERROR'
+
+def get_creation_dates(folder_paths : str) -> str:
+	records = []
+	for path in folder_paths.split('|'):
+		folder = PROJECT.folder(path)
+		if folder is not None:
+			records += ['%s,%s;' % (page.name, get_creation_date(page.name)) for page in folder.pages if page.Type == PGTYPE_WKS]
+	return ''.join(records)
+
+ORIGINC_FUNCTIONS = {
+	'get_creation_date'  : get_creation_date,
+	'get_creation_dates' : get_creation_dates,
+}
+
+CALL_PATTERN   = re.compile('string\\s+(\\w+)\\$\\s*=\\s*(\\w+)\\("([^"]*)"\\)\\$')
+STRING_PATTERN = re.compile('string\\s+(\\w+)\\$\\s*=\\s*"([^"]*)"')
+COLMOVE_PATTERN = re.compile('colmove cols:=col\\((\\d+)\\):col\\((\\d+)\\) operation:=last', re.IGNORECASE)
+USER_PARAM_PATTERN = re.compile('wks\\.userParam(\\d+)(\\$?)\\s*=\\s*"?([^"]*)"?', re.IGNORECASE)
+
+def run_labtalk(statement : str) -> None:
+	"""
+	Runs the few LabTalk statements used by the scripts.
+	"""
+	statement = statement.replace('%X', PROJECT.directory).replace('%G', PROJECT.name)
+
+	match = CALL_PATTERN.fullmatch(statement)
+	if match:
+		(variable, function, argument) = match.groups()
+		PROJECT.variables[variable] = ORIGINC_FUNCTIONS[function](argument)
+		return
+
+	match = STRING_PATTERN.fullmatch(statement)
+	if match:
+		PROJECT.variables[match.group(1)] = match.group(2)
+		return
+
+	if statement.startswith('win -a '):
+		PROJECT.window = statement[len('win -a '):].strip()
+		return
+	if statement == 'win -h 1':
+		PROJECT.pages[PROJECT.window].hidden = True
+		return
+
+	match = COLMOVE_PATTERN.fullmatch(statement)
+	if match:
+		# the columns (data and labels) from first to last, 1-based, are moved after the last column
+		(first, last) = (int(match.group(1)) - 1, int(match.group(2)))
+		columns = PROJECT.pages[PROJECT.window].layers[0].columns
+		columns[first:] = columns[last:] + columns[first:last]
+		return
+
+	match = USER_PARAM_PATTERN.fullmatch(statement)
+	if match:
+		(row, is_name, value) = match.groups()
+		user_params = PROJECT.pages[PROJECT.window].layers[0].user_params
+		if is_name:
+			user_params[int(row)] = value
+		elif value.strip() == '1':
+			user_params.setdefault(int(row), '')
+		else:
+			user_params.pop(int(row), None)
+		return
+
+	raise NotImplementedError('LabTalk statement: ' + statement)
@@ -72,9 +72,16 @@ in nanometers. They must be identical within each Experiment.
 
 import xml.etree.ElementTree as ET
 from collections import namedtuple
-from math import sqrt
+import re
+from concurrent.futures import ProcessPoolExecutor
 from enum import Enum
+import argparse
+import csv
+import hashlib
+import json
 import os
+import zipfile
+import numpy as np
 
 EM_PARKS = (250, 275) + tuple(park for park in range(300, 550 + 1, 10))
 EX_PARKS = tuple(park for park in range(350, 800 + 1, 10))
@@ -86,10 +93,20 @@ SLITS = (
 
 INTEGRATION_TIMES = (0.1, 0.5, 1.0)
 ROOT_DIR_NAME = 'Presets'
+# records the inputs of every preset, so that only the outdated ones are rewritten
+MANIFEST_NAME = 'manifest.json'
+# the whole grid of presets with their ranges and problems, written next to them
+PLAN_NAME = 'plan.csv'
+# a bundle is a zip file of the presets (at their path in the Presets tree) with this index, see preset_bundle.py
+BUNDLE_INDEX_NAME = 'index.json'
+BUNDLE_VERSION = 1
 
 MIN_WAVELENGTH = 240
 MAX_WAVELENGTH = 920
 
+# the lamp light the detector must never see: the park itself and its geometric reflections (n/2, 2n)
+REFLECTIONS = {'n/2 reflection' : 0.5, 'park' : 1, '2n reflection' : 2}
+
 # the type is that of the <Param> elements, NOT of the <Op> elements
 ElementCriteria = namedtuple('ElementCriteria', ['device', 'command', 'type_'])
 
@@ -102,6 +119,20 @@ class ExperimentType(Enum):
     EXCITATION = 'Excitation'
     EMISSION   = 'Emission'
 
+# the safety factor S of the gap between the lamp light and the range, as given by rules.txt:
+# (any slit 10 or above, any slit 5 or above, smaller slits)
+SAFETY_FACTORS = {
+    ExperimentType.EXCITATION : (0.9, 0.8, 0.7),
+    ExperimentType.EMISSION   : (0.9, 0.7, 0.6),
+}
+# the ends of the ranges are rounded to multiples of this (nm)
+RANGE_ROUNDING = 5
+
+TEMPLATE_FILES = {
+    ExperimentType.EXCITATION : 'Excitation.xml',
+    ExperimentType.EMISSION   : 'Emission.xml',
+}
+
 class AlwaysEqual:
     def __eq__(self, _):
         return True
@@ -168,6 +199,33 @@ class ExperimentXML:
         xml_string = ET.tostring(self.tree.getroot(), encoding='unicode', xml_declaration=False, short_empty_elements=True)
         return xml_string.replace('\n', '')
 
+    def compile(self) -> 'CompiledTemplate':
+        return CompiledTemplate(self)
+
+
+class CompiledTemplate:
+    """
+    The document of an ExperimentXML serialized once, split into static chunks around the parameter slots.
+    render() produces the same string as generate_xml() with a single join.
+    """
+    SLOTS = ('ex_slit', 'em_slit', 'park', 'start_wavelength', 'end_wavelength', 'integration_time')
+
+    def __init__(self, exp_obj : ExperimentXML):
+        markers = {slot : f'{{{{{slot}}}}}' for slot in self.SLOTS} # park -> {{park}}
+        xml_string = exp_obj.generate_xml(**markers)
+
+        pattern = '|'.join(re.escape(marker) for marker in markers.values())
+        parts = re.split(f'({pattern})', xml_string)
+
+        self.chunks = parts[0::2]
+        self.slots  = [marker[2:-2] for marker in parts[1::2]]
+
+    def render(self, **parameters) -> str:
+        parts = [None] * (2 * len(self.slots) + 1)
+        parts[0::2] = self.chunks
+        parts[1::2] = [str(parameters[slot]) for slot in self.slots]
+        return ''.join(parts)
+
 
 def print_elems(elements : ET.Element | list[ET.Element]):
     def print_elem(elt : ET.Element) -> None:
@@ -181,58 +239,230 @@ def print_elems(elements : ET.Element | list[ET.Element]):
 
 
 
-def select_range(exp_type : ExperimentType, park : int, ex_slit, em_slit) -> tuple[int, int]:
-    def round_to_multiple(x, multiple):
-        return round(float(x) / multiple) * multiple
+def safety_margin(exp_type : ExperimentType, ex_slit, em_slit) -> np.ndarray:
+    """
+    The gap rules.txt requires between the lamp light and the range, 20 * S * sqrt(Ex + Em)
+    (about 20 nm at slits 1-1, wider for wider slits).
+    """
+    ex_slit = np.asarray(ex_slit, dtype = float)
+    em_slit = np.asarray(em_slit, dtype = float)
+    max_slit = np.maximum(ex_slit, em_slit)
+    (large, medium, small) = SAFETY_FACTORS[exp_type]
+    S = np.select([max_slit >= 10, max_slit >= 5], [large, medium], small)
+    return 20 * S * np.sqrt(em_slit + ex_slit)
+
 
-    max_slit = max(ex_slit, em_slit)
+def select_ranges(exp_type : ExperimentType, park, ex_slit, em_slit) -> tuple[np.ndarray, np.ndarray]:
+    """
+    The (start, end) wavelengths of the experiments, park and the slits are arrays broadcast together.
+    """
+    park   = np.asarray(park, dtype = float)
+    margin = safety_margin(exp_type, ex_slit, em_slit)
 
     match exp_type:
         case ExperimentType.EXCITATION:
-            if max_slit >= 10:
-                S = 0.9
-            elif max_slit >= 5:
-                S = 0.8
-            else:
-                S = 0.7
-            start = park / 2 + 20 * S * sqrt(em_slit + ex_slit)
-            end   = park     - 20 * S * sqrt(em_slit + ex_slit)
+            start = park / 2 + margin
+            end   = park     - margin
         case ExperimentType.EMISSION:
-            if max_slit >= 10:
-                S = 0.9
-            elif max_slit >= 5:
-                S = 0.7
-            else:
-                S = 0.6
-            start =     park + 20 * S * sqrt(em_slit + ex_slit)
-            end   = 2 * park - 20 * S * sqrt(em_slit + ex_slit)
+            start =     park + margin
+            end   = 2 * park - margin
+
+    start = np.maximum(start, MIN_WAVELENGTH)
+    end   = np.minimum(end,   MAX_WAVELENGTH)
+
+    # rounded to multiples of 5 nm (half to even, like round())
+    return (np.round(start / RANGE_ROUNDING) * RANGE_ROUNDING, np.round(end / RANGE_ROUNDING) * RANGE_ROUNDING)
+
+
+def check_ranges(exp_type : ExperimentType, park, ex_slit, em_slit, start, end) -> np.ndarray:
+    """
+    The problems of the experiments, as a string per experiment ('' if there is none).
+    A range collapses when it is empty; it overlaps a reflection band when it comes closer to the park
+    or to one of its reflections (k * park) than the safety margin of rules.txt allows.
+    The margin is the one select_ranges leaves (safety_margin), so a wrong park or a range edited by hand is caught;
+    only the rounding of the ranges may bring them up to RANGE_ROUNDING / 2 into it.
+    """
+    half_width = safety_margin(exp_type, ex_slit, em_slit) - RANGE_ROUNDING / 2
+
+    problems = {'collapsed range' : start >= end}
+    for name, k in REFLECTIONS.items():
+        problems[name] = (start < k * park + half_width) & (end > k * park - half_width)
+
+    status = np.full(np.shape(start), '', dtype = object)
+    for name, mask in problems.items():
+        status[mask] += np.where(status[mask] == '', name, ' + ' + name)
+    return status
 
-    start = max(start, MIN_WAVELENGTH)
-    end   = min(end,   MAX_WAVELENGTH)
 
-    return (round_to_multiple(start, 5), round_to_multiple(end, 5))
+Preset = namedtuple('Preset', ['path', 'exp_type', 'parameters'])
 
+# one array per column of the plan, one row per preset
+Plan = dict[str, np.ndarray]
 
+PLAN_COLUMNS = (
+    'path', 'exp_type', 'ex_slit', 'em_slit', 'park', 'integration_time', 'start_wavelength', 'end_wavelength', 'status'
+)
+
+
+def plan_grid(exp_type : ExperimentType, parks : tuple) -> Plan:
+    """
+    The (slit pair x integration time x park) grid of an experiment type, with the ranges and their problems.
+    """
+    (slit, time, park) = np.indices((len(SLITS), len(INTEGRATION_TIMES), len(parks))).reshape(3, len(SLITS), -1)
+
+    # the slit pairs are (Ex, Em) with Ex >= Em for Emission, inverted for Excitation
+    (small, large) = np.sort(np.array(SLITS, dtype = float), axis = 1).T
+    if exp_type is ExperimentType.EMISSION:
+        (ex_slit, em_slit) = (large[slit], small[slit])
+    else:
+        (ex_slit, em_slit) = (small[slit], large[slit])
+    park = np.asarray(parks)[park]
+
+    (start, end) = select_ranges(exp_type, park, ex_slit, em_slit)
+
+    return {
+        'slit'             : slit,
+        'exp_type'         : np.full(slit.shape, exp_type, dtype = object),
+        'ex_slit'          : ex_slit,
+        'em_slit'          : em_slit,
+        'park'             : park,
+        'integration_time' : np.asarray(INTEGRATION_TIMES)[time],
+        'start_wavelength' : start.astype(int),
+        'end_wavelength'   : end.astype(int),
+        'status'           : check_ranges(exp_type, park, ex_slit, em_slit, start, end),
+    }
+
+
+def plan_presets_grid() -> Plan:
+    """
+    The whole grid of presets, in the order of their directories: slit pair, Emission before Excitation,
+    integration time, park.
+    """
+    grids = [plan_grid(ExperimentType.EMISSION, EM_PARKS), plan_grid(ExperimentType.EXCITATION, EX_PARKS)]
+    # the grids are (slit pair, experiment) 2D arrays, joined along the experiments
+    plan = {column : np.concatenate([grid[column] for grid in grids], axis = 1).ravel() for column in grids[0]}
+
+    def label(value) -> str:
+        return f"{value:g}" # 1.0 -> '1', 1.5 -> '1.5' like the values of SLITS
+
+    plan['path'] = np.array([
+        f"{ROOT_DIR_NAME}/{label(max(ex, em))}-{label(min(ex, em))}/{time}/"
+        f"{exp_type.value}_{park}_{label(ex)}_{label(em)}_{time}.xml"
+        for (exp_type, ex, em, park, time) in
+        zip(plan['exp_type'], plan['ex_slit'], plan['em_slit'], plan['park'], plan['integration_time'])
+    ], dtype = object)
+    del plan['slit']
+    return plan
+
+
+def plan_presets(plan : Plan, keep_invalid : bool = False) -> list[Preset]:
+    """
+    The presets of the plan, without those that have a problem unless keep_invalid.
+    """
+    presets = []
+    for i in range(len(plan['path'])):
+        if plan['status'][i] != '' and not keep_invalid:
+            continue
+
+        (ex_slit, em_slit) = (plan['ex_slit'][i], plan['em_slit'][i])
+        parameters = {
+            'ex_slit' : int(ex_slit) if ex_slit.is_integer() else float(ex_slit),
+            'em_slit' : int(em_slit) if em_slit.is_integer() else float(em_slit),
+            'park' : int(plan['park'][i]), 'integration_time' : float(plan['integration_time'][i]),
+            'start_wavelength' : int(plan['start_wavelength'][i]),
+            'end_wavelength' : int(plan['end_wavelength'][i])
+        }
+        presets.append(Preset(plan['path'][i], plan['exp_type'][i], parameters))
+
+    return presets
+
+
+def write_plan(path : str, plan : Plan) -> None:
+    with open(path, mode = 'w', newline = '') as f:
+        writer = csv.writer(f)
+        writer.writerow(PLAN_COLUMNS)
+        for row in zip(*(plan[column] for column in PLAN_COLUMNS)):
+            writer.writerow([value.value if isinstance(value, ExperimentType) else value for value in row])
+
+
+templates : dict[ExperimentType, CompiledTemplate] = {} # compiled once per process
+
+def get_template(exp_type : ExperimentType) -> CompiledTemplate:
+    if exp_type not in templates:
+        templates[exp_type] = ExperimentXML(TEMPLATE_FILES[exp_type], exp_type).compile()
+    return templates[exp_type]
+
+
+def write_presets(presets : list[Preset]) -> list[str]:
+    """
+    Writes the presets, returns one message per file (the workers do not print, so that lines do not interleave).
+    """
+    messages = []
+    for preset in presets:
+        xml_string = get_template(preset.exp_type).render(**preset.parameters)
+
+        with open(preset.path, mode = 'w') as f:
+            f.write(xml_string)
+
+        (start_wavelength, end_wavelength) = (preset.parameters['start_wavelength'], preset.parameters['end_wavelength'])
+        messages.append(f"{os.path.basename(preset.path)} has range {(start_wavelength, end_wavelength)} nm")
+
+    return messages
+
+
+def preset_key(exp_type : str, park, ex_slit, em_slit, integration_time) -> str:
+    """
+    'Emission|300|2|1|0.1': the key of a preset in the index of a bundle.
+    """
+    return f"{exp_type}|{int(park)}|{float(ex_slit):g}|{float(em_slit):g}|{float(integration_time):g}"
+
+
+def write_bundle(path : str, presets : list[Preset], plan_path : str) -> None:
+    """
+    Writes the presets and the plan into a single zip file, with an index of the presets by preset_key:
+    {key : [member name, start wavelength, end wavelength]}
+    """
+    index = {}
+    # written aside then moved, like the manifest
+    with zipfile.ZipFile(path + '.tmp', mode = 'w', compression = zipfile.ZIP_DEFLATED) as bundle:
+        for preset in presets:
+            name = preset.path[len(ROOT_DIR_NAME) + 1:] # 2-1/0.1/Emission_300_2_1_0.1.xml
+            bundle.writestr(name, get_template(preset.exp_type).render(**preset.parameters))
 
-def generate_files(dir_path : str, exp_obj : ExperimentXML, *, em_slit, ex_slit, exp_type : ExperimentType, parks):
-    for integration_time in INTEGRATION_TIMES:
-        for park in parks:
-            filename = f"{exp_type.value}_{park}_{ex_slit}_{em_slit}_{integration_time}.xml"
-            path = f"{dir_path}/{integration_time}/{filename}"
+            parameters = preset.parameters
+            key = preset_key(preset.exp_type.value, parameters['park'], parameters['ex_slit'], parameters['em_slit'],
+                             parameters['integration_time'])
+            index[key] = [name, parameters['start_wavelength'], parameters['end_wavelength']]
+
+        bundle.write(plan_path, PLAN_NAME)
+        bundle.writestr(BUNDLE_INDEX_NAME, json.dumps({'version' : BUNDLE_VERSION, 'presets' : index}, separators = (',', ':')))
+    os.replace(path + '.tmp', path)
 
-            (start_wavelength, end_wavelength) = select_range(exp_type, park, ex_slit, em_slit)
-            parameters = {
-                'ex_slit' : ex_slit, 'em_slit' : em_slit,
-                'park' : park, 'integration_time' : integration_time,
-                'start_wavelength' : start_wavelength,
-                'end_wavelength' : end_wavelength
-            }
-            xml_string = exp_obj.generate_xml(**parameters)
 
-            with open(path, mode = 'w') as f:
-                f.write(xml_string)
+def file_hash(path : str) -> str:
+    with open(path, mode = 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def parameters_hash(preset : Preset) -> str:
+    key = json.dumps([preset.exp_type.value, preset.parameters], sort_keys = True)
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+def read_manifest(path : str) -> dict:
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def write_manifest(path : str, manifest : dict) -> None:
+    # written aside then moved, an interrupted run leaves the previous manifest intact
+    with open(path + '.tmp', mode = 'w') as f:
+        json.dump(manifest, f, indent = 0, sort_keys = True)
+    os.replace(path + '.tmp', path)
 
-            print(f"{filename} has range {(start_wavelength, end_wavelength)} nm")
 
 def mkdir(path):
     try:
@@ -241,28 +471,84 @@ def mkdir(path):
         pass
 
 
+def parse_arguments() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description = f"Generates the FluorEssence presets into the {ROOT_DIR_NAME} directory.")
+    parser.add_argument('-j', '--jobs', type = int, default = 1,
+                        help = 'number of worker processes, 0 for one per CPU (default: 1)')
+    parser.add_argument('-f', '--force', action = 'store_true',
+                        help = 'rewrite every preset, even those that are up to date in the manifest')
+    parser.add_argument('--keep-invalid', action = 'store_true',
+                        help = f"also write the presets that have a problem in {PLAN_NAME} (collapsed range, reflection)")
+    parser.add_argument('--plan-only', action = 'store_true',
+                        help = f"only check the grid and write {PLAN_NAME}")
+    parser.add_argument('--bundle', metavar = 'FILE',
+                        help = f"write the presets to a single zip file with an index instead of the {ROOT_DIR_NAME} tree "
+                               "(see preset_bundle.py)")
+    return parser.parse_args()
+
+
 def main():
-    EX_EXP = ExperimentXML('Excitation.xml', ExperimentType.EXCITATION)
-    EM_EXP = ExperimentXML('Emission.xml',   ExperimentType.EMISSION)
+    args = parse_arguments()
 
+    plan = plan_presets_grid()
     mkdir(ROOT_DIR_NAME)
+    write_plan(f"{ROOT_DIR_NAME}/{PLAN_NAME}", plan)
+
+    invalid = plan['status'] != ''
+    for path, status in zip(plan['path'][invalid], plan['status'][invalid]):
+        print(f"{os.path.basename(path)}: {status}")
+    print(f"{len(plan['path'])} presets planned, {invalid.sum()} with a problem "
+          f"({'kept' if args.keep_invalid else 'not written'}), see {ROOT_DIR_NAME}/{PLAN_NAME}")
+    if args.plan_only:
+        return
+
+    presets = plan_presets(plan, args.keep_invalid)
+    if args.bundle:
+        write_bundle(args.bundle, presets, f"{ROOT_DIR_NAME}/{PLAN_NAME}")
+        print(f"{len(presets)} presets written to {args.bundle}")
+        return
+
+    template_hashes = {exp_type : file_hash(path) for exp_type, path in TEMPLATE_FILES.items()}
+
+    manifest_path = f"{ROOT_DIR_NAME}/{MANIFEST_NAME}"
+    old_manifest = read_manifest(manifest_path)
+    manifest = {}
+    outdated = []
+
+    for preset in presets:
+        entry = {'parameters' : parameters_hash(preset), 'template' : template_hashes[preset.exp_type]}
+        manifest[preset.path] = entry
+        if args.force or old_manifest.get(preset.path) != entry or not os.path.exists(preset.path):
+            outdated.append(preset)
+
+    # one group per (slit, integration time) directory
+    groups : dict[str, list[Preset]] = {}
+    for preset in outdated:
+        groups.setdefault(os.path.dirname(preset.path), []).append(preset)
+
+    for dir_path in groups:
+        mkdir(os.path.dirname(dir_path))
+        mkdir(dir_path)
 
-    for slit in SLITS:
-        em_slit, ex_slit = sorted(slit)
+    if args.jobs == 1:
+        results = map(write_presets, groups.values())
+        for messages in results:
+            print('\n'.join(messages))
+    else:
+        with ProcessPoolExecutor(max_workers = args.jobs or None) as pool:
+            for messages in pool.map(write_presets, groups.values()):
+                print('\n'.join(messages))
 
-        dir_path = f"{ROOT_DIR_NAME}/{ex_slit}-{em_slit}"
-        mkdir(dir_path)
-        for time in INTEGRATION_TIMES:
-            mkdir(f"{dir_path}/{time}")
+    stale = [path for path in old_manifest if path not in manifest]
+    for path in stale:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
 
-        # Emission   : Ex >= Em
-        exp_type = ExperimentType.EMISSION
-        generate_files(dir_path, EM_EXP, em_slit=em_slit, ex_slit=ex_slit, exp_type=exp_type, parks=EM_PARKS)
+    write_manifest(manifest_path, manifest)
 
-        # Excitation : Em >= Ex
-        exp_type = ExperimentType.EXCITATION
-        em_slit, ex_slit = (ex_slit, em_slit)
-        generate_files(dir_path, EX_EXP, em_slit=em_slit, ex_slit=ex_slit, exp_type=exp_type, parks=EX_PARKS)
+    print(f"{len(outdated)} presets written, {len(presets) - len(outdated)} up to date, {len(stale)} stale presets deleted")
 
 
 if __name__ == '__main__':
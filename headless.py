@@ -0,0 +1,365 @@
+"""
+Builds the master sheets of master_sheets.py without Origin, from spectra exported by FluorEssence.
+The modes, the Ex/Em classification, the creation-date ordering and the normalization are those of master_sheets.py,
+the masters are written as CSV files.
+
+Input: a directory tree, every directory holding spectra is processed like an Origin folder
+(its name gives the prefix of the masters, e.g. TN76_DCM_... -> TN76).
+
+	TN76_DCM_.../
+		name.txt        first column: X (wavelengths), next columns: Y (tab, comma or semicolon separated)
+		                lines that are not numbers are headers, the last one before the data names the Y columns
+		name.note.txt   (optional) the Note of the spectrum
+
+The long name of a spectrum is built from its Note as rename_files.c would, or is the file name if there is no
+(complete) Note, which also gives its experiment type. Its creation date, which orders the columns of the masters,
+is the acquisition date of a header line of the Note or of the spectrum ("Date: 14/06/2023 07:44", see DATE_FORMATS);
+the modification time of the file is only a fallback (with a warning): copying the files usually changes it.
+
+Output: one CSV per master (e.g. NORM_TN76_Em.csv), 4 header rows (long names, units, comments,
+creation times of the spectra) then one row per wavelength. Existing masters are appended to, like in Origin.
+
+usage:
+	python headless.py INPUT OUTPUT                                  (automatic)
+	python headless.py INPUT OUTPUT --mode titration                 (titration / batch)
+	python headless.py INPUT OUTPUT --mode interactive --wavelength 380 400 420 --exp-type Emission
+	python headless.py INPUT OUTPUT --export EXPORT                  (also appends the new columns to .npy files, see master_export.py)
+	python headless.py INPUT OUTPUT --process mask,smooth:9          (also writes processed PROC_ masters, see processing.py)
+	python headless.py INPUT OUTPUT --mode titration --titration --concentrations 0 1 2 5 10 --host 2
+	                                                                 (also analyzes the STACK masters into FIT_ sheets, see titration.py)
+"""
+
+import argparse
+import csv
+import os
+import re
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+import master_sheets
+from master_export import MasterExport
+from processing import DEFAULT_CHAIN, Processing
+from titration import DEFAULT_COMPONENTS, analyze_master, write_results_csv
+from master_sheets import (
+	Backend, Column, ExpType, MasterSheet, Mode, PageInfo, ProjectSnapshot,
+	BATCH_LAYER_NAME, NORMAL_LAYER_NAME, PGTYPE_WKS, PREFIX_BATCH, PREFIX_FIT, X_END, X_NAME, X_START, X_UNIT,
+)
+from note_parser import add_duplicate_suffixes, build_long_name, parse_note
+
+SPECTRUM_EXTENSIONS = ('.txt', '.csv', '.dat')
+NOTE_SUFFIX = '.note.txt'
+MASTER_EXTENSION = '.csv'
+
+SEPARATOR_PATTERN = re.compile('[\t,;]')
+
+# header line giving the acquisition date, in the Note or before the data of the spectrum
+DATE_LINE_PATTERN = re.compile('^\\s*(?:acquisition\\s+)?(?:date|time\\s*stamp|created)\\s*[:=]\\s*(.+?)\\s*$', re.IGNORECASE | re.MULTILINE)
+# the format of the creation dates of Origin first (see master_sheets.parse_creation_date)
+DATE_FORMATS = ('%d/%m/%Y %H:%M', '%d/%m/%Y %H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%d %H:%M:%S', '%Y-%m-%dT%H:%M:%S')
+
+
+
+def split_line(line : str) -> List[str]:
+	line = line.strip()
+	if SEPARATOR_PATTERN.search(line):
+		return [field.strip() for field in SEPARATOR_PATTERN.split(line)]
+	return line.split()
+
+
+
+def find_acquisition_date(text : str) -> Optional[datetime]:
+	"""
+	The date of the first header line of the text (DATE_LINE_PATTERN) in one of DATE_FORMATS, None if there is none.
+	"""
+	for match in DATE_LINE_PATTERN.finditer(text):
+		for date_format in DATE_FORMATS:
+			try:
+				return datetime.strptime(match.group(1), date_format)
+			except ValueError:
+				continue
+	return None
+
+
+
+def read_spectrum(path : str) -> Tuple[List[str], List[list], Optional[datetime]]:
+	"""
+	(column names, columns, acquisition date) of an exported spectrum, empty cells are empty strings (like PyOrigin's GetData),
+	the date is read from the headers (None if they have none)
+	"""
+	names = []
+	columns = []
+	headers = []
+
+	with open(path) as f:
+		for line in f:
+			fields = split_line(line)
+			if len(fields) == 0:
+				continue
+			try:
+				values = ['' if field == '' else float(field) for field in fields]
+			except ValueError:
+				if len(columns) == 0:
+					names = fields
+					headers.append(line)
+				continue
+
+			if len(columns) < len(values):
+				rows_count = len(columns[0]) if columns else 0
+				columns += [[''] * rows_count for _ in range(len(values) - len(columns))]
+			for i, column in enumerate(columns):
+				column.append(values[i] if i < len(values) else '')
+
+	return (names, columns, find_acquisition_date(''.join(headers)))
+
+
+
+def is_number(string : str) -> bool:
+	try:
+		float(string)
+		return True
+	except ValueError:
+		return False
+
+
+
+def is_spectrum(filename : str) -> bool:
+	return filename.endswith(SPECTRUM_EXTENSIONS) and not filename.endswith(NOTE_SUFFIX)
+
+
+
+class CsvMasterSheet(MasterSheet):
+	"""
+	A master sheet saved as CSV: long names, units, comments and creation times rows, then one row per wavelength.
+	"""
+	def __init__(self, path : str) -> None:
+		self.path = path
+		self.labels : List[List[str]] = [[], [], [], []]
+		self.columns : List[list] = []
+
+		if os.path.exists(path):
+			with open(path, newline = '') as f:
+				rows = list(csv.reader(f))
+			# masters written before the creation times were added have 3 label rows
+			labels_count = next((i for i, row in enumerate(rows) if is_number(row[0])), len(rows))
+			self.labels = [list(row) for row in rows[:labels_count]]
+			self.labels += [[''] * len(self.labels[0]) for _ in range(4 - labels_count)]
+			self.columns = [list(column) for column in zip(*rows[labels_count:])]
+
+	def long_names(self) -> List[str]:
+		return self.labels[0]
+
+	def creation_times(self) -> List[str]:
+		return self.labels[3]
+
+	def append(self, columns : List[Column]) -> None:
+		self.add_columns(columns)
+		self.save()
+
+	def read(self, first : int) -> List[Column]:
+		(long_names, _, comments, creation_times) = self.labels
+		return [
+			Column(long_names[i], comments[i], self.columns[i], X_START, creation_times[i])
+			for i in range(first, len(self.columns))
+		]
+
+	def insert(self, positions : List[int], columns : List[Column]) -> None:
+		count = len(self.columns)
+		self.add_columns(columns)
+		order = master_sheets.insertion_order(count, positions)
+		self.columns = [self.columns[i] for i in order]
+		self.labels = [[labels[i] for i in order] for labels in self.labels]
+		self.save()
+
+	def add_columns(self, columns : List[Column]) -> None:
+		"""
+		Adds the columns after the existing ones (in memory, see save).
+		"""
+		rows_count = len(master_sheets.grid_wavelengths())
+		if len(self.columns) == 0:
+			for labels, label in zip(self.labels, (X_NAME, X_UNIT, '', '')):
+				labels.append(label)
+			self.columns.append(master_sheets.grid_wavelengths().tolist())
+
+		for column in columns:
+			for labels, label in zip(self.labels, (column.long_name, master_sheets.Y_UNIT, column.comments, column.creation_time)):
+				labels.append(label)
+			rows = column.padded_rows()[:rows_count]
+			self.columns.append(rows + [''] * (rows_count - len(rows)))
+
+	def save(self) -> None:
+		with open(self.path, mode = 'w', newline = '') as f:
+			writer = csv.writer(f)
+			writer.writerows(self.labels)
+			writer.writerows(zip(*self.columns))
+
+
+
+class FileSystemBackend(Backend):
+	def __init__(self, output_dir : str) -> None:
+		self.output_dir = output_dir
+		self.spectra : Dict[str, Tuple[List[str], List[list]]] = {} # page name -> (column names, columns)
+		self.masters : Dict[str, CsvMasterSheet] = {}
+
+	def snapshot(self, directory : str, root : str) -> ProjectSnapshot:
+		"""
+		Reads the spectra of a directory (they are small, they are kept in memory).
+		"""
+		folder_name = os.path.basename(os.path.normpath(directory))
+		self.spectra = {}
+		pages = []
+		names = []
+
+		for filename in sorted(os.listdir(directory)):
+			path = os.path.join(directory, filename)
+			if not is_spectrum(filename) or not os.path.isfile(path):
+				continue
+
+			name = os.path.splitext(filename)[0]
+			(column_names, columns, creation_date) = read_spectrum(path)
+			self.spectra[name] = (column_names, columns)
+
+			(long_name, exp_type) = (name, None)
+			note_path = os.path.join(directory, name + NOTE_SUFFIX)
+			if os.path.exists(note_path):
+				with open(note_path) as f:
+					text = f.read()
+				record = parse_note(text)
+				creation_date = find_acquisition_date(text) or creation_date
+				try:
+					long_name = build_long_name(folder_name, record.check())
+					exp_type = ExpType.from_note(record.experiment_type)
+				except KeyError as error:
+					print('%s: %s' % (note_path, error))
+
+			if creation_date is None:
+				creation_date = datetime.fromtimestamp(os.path.getmtime(path))
+				print('warning: %s has no acquisition date, the modification time of the file is used (%s)' %
+					(path, creation_date.strftime(master_sheets.CREATION_TIME_FORMAT))
+				)
+			layers = (BATCH_LAYER_NAME,) if len(columns) > 2 else (NORMAL_LAYER_NAME,)
+			pages.append(PageInfo(name, long_name, PGTYPE_WKS, creation_date, layers, exp_type))
+			names.append((creation_date, long_name))
+
+		long_names = add_duplicate_suffixes(names)
+		pages = [page._replace(long_name = long_name) for page, long_name in zip(pages, long_names)]
+
+		folder_path = '/' + os.path.relpath(directory, root).replace(os.sep, '/') + '/'
+		return ProjectSnapshot(folder_name, folder_path, pages)
+
+	def column_count(self, page : PageInfo) -> int:
+		return len(self.spectra[page.name][1])
+
+	def read_x(self, page : PageInfo) -> list:
+		return [x for x in self.spectra[page.name][1][0] if x != '']
+
+	def read_column(self, page : PageInfo, index : int) -> Tuple[str, str, list]:
+		(names, columns) = self.spectra[page.name]
+		comments = names[index] if index < len(names) else ''
+		return (page.long_name, comments, columns[index])
+
+	def release(self, page : PageInfo) -> None:
+		self.spectra.pop(page.name, None)
+
+	def open_master(self, exp_type : ExpType, prefix : str, long_name : str) -> MasterSheet:
+		path = os.path.join(self.output_dir, long_name + MASTER_EXTENSION)
+		if path not in self.masters:
+			print('%s master sheet %s' % ('found' if os.path.exists(path) else 'created', path))
+			self.masters[path] = CsvMasterSheet(path)
+		return self.masters[path]
+
+
+
+def find_folders(root : str) -> List[str]:
+	"""
+	The directories of the tree that hold spectra.
+	"""
+	folders = []
+	for directory, subdirectories, filenames in os.walk(root):
+		subdirectories.sort()
+		if any(is_spectrum(filename) for filename in filenames):
+			folders.append(directory)
+	return folders
+
+
+
+def analyze_masters(output_dir : str, concentrations : Optional[List[float]], host : Optional[float], components : int) -> None:
+	"""
+	Analyzes the STACK masters of the directory into FIT_ sheets next to them (see titration.py).
+	"""
+	concentrations = np.array(concentrations) if concentrations is not None else None
+	for filename in sorted(os.listdir(output_dir)):
+		(long_name, extension) = os.path.splitext(filename)
+		if extension != MASTER_EXTENSION or not long_name.startswith(PREFIX_BATCH + '_'):
+			continue
+
+		print('analyzing master sheet %s' % filename)
+		try:
+			(_, results) = analyze_master(CsvMasterSheet(os.path.join(output_dir, filename)), concentrations, host, components)
+		except ValueError as error:
+			print('error: %s is not analyzed: %s' % (long_name, error))
+			continue
+		path = os.path.join(output_dir, PREFIX_FIT + '_' + long_name + MASTER_EXTENSION)
+		write_results_csv(path, results)
+		print('results written to %s' % path)
+
+
+
+def parse_arguments() -> argparse.Namespace:
+	parser = argparse.ArgumentParser(description = 'Builds the NORM/STACK master sheets from exported spectra, without Origin.')
+	parser.add_argument('input', help = 'directory tree of exported spectra')
+	parser.add_argument('output', help = 'directory where the masters are written')
+	parser.add_argument('--mode', choices = ('automatic', 'interactive', 'titration'), default = 'automatic',
+	                    help = "'titration' switches to batch mode for folders of multi-column spectra, like in Origin")
+	parser.add_argument('--wavelength', type = int, nargs = '+', help = 'normalizing wavelengths (interactive mode)')
+	parser.add_argument('--exp-type', choices = ('Emission', 'Excitation'), help = 'experiment type (interactive mode)')
+	parser.add_argument('--export', metavar = 'DIRECTORY', help = 'directory of the columnar export of the masters')
+	parser.add_argument('--process', metavar = 'CHAIN', nargs = '?', const = DEFAULT_CHAIN,
+	                    help = 'processes the new columns into PROC_ masters (default chain: %s)' % DEFAULT_CHAIN)
+	parser.add_argument('--titration', action = 'store_true',
+	                    help = 'analyzes the STACK masters of OUTPUT (SVD and 1:1 binding fit) into FIT_ sheets')
+	parser.add_argument('--concentrations', type = float, nargs = '+',
+	                    help = 'titrant concentrations of the points (default: equal additions 0, 1, 2...)')
+	parser.add_argument('--host', type = float, help = 'total concentration of the host (default: titrant in excess)')
+	parser.add_argument('--components', type = int, default = DEFAULT_COMPONENTS, help = 'number of SVD components')
+
+	args = parser.parse_args()
+	if args.mode == 'interactive' and (args.wavelength is None or args.exp_type is None):
+		parser.error('the interactive mode needs --wavelength and --exp-type')
+	return args
+
+
+
+def main():
+	args = parse_arguments()
+	os.makedirs(args.output, exist_ok = True)
+	backend = FileSystemBackend(args.output)
+	if args.export is not None:
+		master_sheets.EXPORT = MasterExport(args.export, X_START, X_END, master_sheets.X_STEP, master_sheets.SPECTRUM_DTYPE)
+	if args.process is not None:
+		master_sheets.PROCESSING = Processing(args.process, X_START, X_END, master_sheets.X_STEP, master_sheets.SPECTRUM_DTYPE)
+
+	summary = []
+	for directory in find_folders(args.input):
+		snapshot = backend.snapshot(directory, args.input)
+
+		if args.mode == 'interactive':
+			exp_type = ExpType.EMISSION if args.exp_type == 'Emission' else ExpType.EXCITATION
+			master_sheets.configure(Mode.INTERACTIVE, args.wavelength, exp_type)
+		elif args.mode == 'titration':
+			master_sheets.configure(Mode.BATCH if master_sheets.detect_batch_mode(snapshot) else Mode.TITRATION)
+		else:
+			master_sheets.configure(Mode.AUTOMATIC)
+
+		print("working in mode: " + str(master_sheets.MODE))
+		summary.append((snapshot.folder_path, master_sheets.MODE, master_sheets.main(snapshot, backend)))
+
+	backend.close()
+	master_sheets.print_summary(summary)
+
+	if args.titration:
+		analyze_masters(args.output, args.concentrations, args.host, args.components)
+
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,139 @@
+"""
+Columnar export of the master sheets, for the analysis scripts (PCA, fits, plots) that would otherwise
+parse CSV files exported by hand from Origin.
+
+Every master is exported to two files, named after its long name:
+
+	STACK_TN76_DCM.npy    2D float matrix, one row per column of the master, on the X_START..X_END grid (every X_STEP)
+	                      (NaN where the spectrum has no data)
+	STACK_TN76_DCM.csv    one line per row of the matrix: long name, comments, creation time, mode
+
+The export is incremental: the columns added to a master by a run are appended to its files in place,
+in the order they were added (sort the rows by creation time for the order of the master).
+A master that is deleted and rebuilt should have its export deleted too.
+
+	spectra = np.load('STACK_TN76_DCM.npy', mmap_mode = 'r') # nothing is read until it is used
+"""
+
+import csv
+import io
+import os
+from typing import Optional
+import numpy as np
+from note_cache import project_file_path
+
+# the default directory is next to the project: MyProject.opju -> MyProject.masters
+DIRECTORY_SUFFIX = '.masters'
+
+SIDECAR_FIELDS = ['long_name', 'comments', 'creation_time', 'mode']
+
+
+
+def project_export_directory() -> Optional[str]:
+	"""
+	The default export directory of the current project, None if the project was never saved.
+	"""
+	return project_file_path(DIRECTORY_SUFFIX)
+
+
+
+def write_header(f, version : tuple, shape : tuple, dtype : np.dtype) -> None:
+	header = {'descr' : np.lib.format.dtype_to_descr(dtype), 'fortran_order' : False, 'shape' : shape}
+	if version == (1, 0):
+		np.lib.format.write_array_header_1_0(f, header)
+	else:
+		np.lib.format.write_array_header_2_0(f, header)
+
+
+
+def append_rows(path : str, rows : np.ndarray) -> int:
+	"""
+	Appends rows to a 2D .npy file (created if there is none), returns its new number of rows.
+	The data is appended in place and the shape of the header rewritten (numpy leaves room in it for that),
+	the file is only rewritten as a whole if the new header would not fit.
+	"""
+	if not os.path.exists(path):
+		np.save(path, rows)
+		return len(rows)
+
+	with open(path, 'r+b') as f:
+		version = np.lib.format.read_magic(f)
+		if version == (1, 0):
+			(shape, fortran_order, dtype) = np.lib.format.read_array_header_1_0(f)
+		else:
+			(shape, fortran_order, dtype) = np.lib.format.read_array_header_2_0(f)
+		if fortran_order or len(shape) != 2 or shape[1] != rows.shape[1] or dtype != rows.dtype:
+			raise ValueError('%s holds a %s %s matrix, %d columns of %s were expected' %
+				(path, 'x'.join(map(str, shape)), dtype, rows.shape[1], rows.dtype)
+			)
+
+		header_length = f.tell()
+		new_shape = (shape[0] + len(rows), shape[1])
+		header = io.BytesIO()
+		write_header(header, version, new_shape, dtype)
+
+		if len(header.getvalue()) == header_length:
+			f.seek(header_length + shape[0] * shape[1] * dtype.itemsize)
+			f.write(np.ascontiguousarray(rows).tobytes())
+			f.truncate()
+			# the header last: until it is rewritten, the file holds the previous rows
+			f.seek(0)
+			f.write(header.getvalue())
+			return new_shape[0]
+
+	matrix = np.load(path)
+	np.save(path, np.concatenate([matrix, rows]))
+	return new_shape[0]
+
+
+
+def to_grid(columns : list, x_start : float, x_end : float, x_step : float = 1, dtype = np.float64) -> np.ndarray:
+	"""
+	The columns (x_start and values every x_step) on the x_start..x_end grid, one per row, NaN where they have no data.
+	"""
+	rows = np.full((len(columns), int(round((x_end - x_start) / x_step)) + 1), np.nan, dtype = dtype)
+	for row, column in zip(rows, columns):
+		offset = int(round((column.x_start - x_start) / x_step))
+		# the parts of the spectrum out of the grid are dropped
+		first = max(-offset, 0)
+		last = min(len(column.values), len(row) - offset)
+		if first < last:
+			row[offset + first : offset + last] = column.values[first : last]
+	return rows
+
+
+
+class MasterExport:
+	"""
+	Appends the new columns of the masters to their export in a directory.
+	The columns are those of master_sheets.Column: x_start and values (first wavelength and data),
+	long_name, comments, creation_time.
+	"""
+	def __init__(self, directory : str, x_start : float, x_end : float, x_step : float = 1, dtype = np.float64) -> None:
+		self.directory = directory
+		self.x_start = x_start
+		self.x_end = x_end
+		self.x_step = x_step
+		self.dtype = np.dtype(dtype)
+
+	def append(self, long_name : str, columns : list, mode : str) -> None:
+		if len(columns) == 0:
+			return
+
+		os.makedirs(self.directory, exist_ok = True)
+		path = os.path.join(self.directory, long_name)
+		try:
+			count = append_rows(path + '.npy', to_grid(columns, self.x_start, self.x_end, self.x_step, self.dtype))
+		except ValueError as error:
+			print('error: the master %s is not exported: %s' % (long_name, error))
+			return
+
+		sidecar = path + '.csv'
+		new = not os.path.exists(sidecar)
+		with open(sidecar, mode = 'a', newline = '') as f:
+			writer = csv.writer(f)
+			if new:
+				writer.writerow(SIDECAR_FIELDS)
+			writer.writerows([column.long_name, column.comments, column.creation_time, mode] for column in columns)
+
+		print('exported %d columns to %s.npy (%d spectra)' % (len(columns), path, count))
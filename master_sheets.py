@@ -1,14 +1,29 @@
+from __future__ import annotations
+import bisect
+import copy
+import re
 import sys
 from enum import Enum
-from typing import Dict, List
+from typing import Callable, Dict, List, Iterable, Optional, Tuple
+from collections import namedtuple
 from datetime import datetime
-import PyOrigin
-# for type hints:
-from PyOrigin import CPyOriginCollectionBase, CPyColumn, CPyWorksheet, CPyWorksheetPage, CPyPageBase, CPyFolder
+import numpy as np
+import profiling
+from master_export import MasterExport, project_export_directory
+from processing import DEFAULT_CHAIN, Processing
+try:
+	import PyOrigin
+	# for type hints:
+	from PyOrigin import CPyOriginCollectionBase, CPyColumn, CPyWorksheet, CPyFolder
+except ImportError: # outside of Origin: only the headless backend (headless.py) can be used
+	PyOrigin = None
 
 
 X_START =  200
 X_END   = 1000
+# resolution of the masters in nm (one row every X_STEP), the spectra acquired with another step are resampled;
+# the masters built with a step cannot be extended with another one
+X_STEP  = 1
 
 X_NAME = 'Wavelength'
 
@@ -21,6 +36,49 @@ BATCH_LAYER_NAME  = 'Data_S1c'
 
 PREFIX_BATCH = 'STACK'
 PREFIX_NORM  = 'NORM'
+# processed copy of a master (see processing.py): PROC_NORM_TN76_Em
+PREFIX_PROCESSED = 'PROC'
+# results of the analysis of a STACK master (see titration.py): FIT_STACK_TN76_DCM
+PREFIX_FIT = 'FIT'
+
+# hidden worksheet of the project's root holding the index of the master sheets
+INDEX_SHORT_NAME = 'MasterIndex'
+INDEX_LONG_NAME  = 'MASTER_INDEX'
+
+# argument of the .ogs launchers enabling the instrumentation (see profiling.py)
+PROFILE_OPTION = '--profile'
+# argument of the .ogs launchers processing every folder of the project instead of the active one
+PROJECT_OPTION = '--project'
+# argument of the .ogs launchers exporting the new columns of the masters (see master_export.py),
+# '--export=C:\path\to\directory' instead of the default directory next to the project
+EXPORT_OPTION = '--export'
+# argument of the .ogs launchers processing the new columns of the masters into a PREFIX_PROCESSED master,
+# '--process=mask,baseline,smooth:9' for another chain than DEFAULT_CHAIN (see processing.py)
+PROCESS_OPTION = '--process'
+# experiment types of master_sheets_interactive.ogs, the last argument in INTERACTIVE mode
+INTERACTIVE_EXP_TYPES = ('Emission', 'Excitation')
+
+# user parameter row of the masters holding the creation time of the worksheet each column comes from
+CREATION_TIME_ROW   = 'D1'
+CREATION_TIME_LABEL = 'Created'
+CREATION_TIME_FORMAT = '%Y-%m-%d %H:%M' # sorts like the dates
+
+# spectra are held as contiguous arrays, np.float32 halves the memory used by BATCH mode
+SPECTRUM_DTYPE = np.float64
+
+# new columns are written to the master as one 2D block by a single CPyWorksheet.SetData call,
+# False falls back to one CPyColumn.SetData call per column
+BLOCK_WRITE = True
+
+# BATCH mode writes the columns of every worksheet to the master as soon as they are read and releases them,
+# so that the memory used is bounded by the largest worksheet instead of the whole folder;
+# False collects the columns of the folder first and writes them in one go
+STREAM_BATCH = True
+
+# where make_master_sheet exports the new columns of the masters, set by EXPORT_OPTION (and headless.py --export)
+EXPORT : Optional[MasterExport] = None
+# the processing of the new columns of the masters, set by PROCESS_OPTION (and headless.py --process)
+PROCESSING : Optional[Processing] = None
 
 class Mode(Enum):
 # Default mode: extracts the second column (first Y column) from every
@@ -28,9 +86,9 @@ class Mode(Enum):
 # them to a master sheet in the project's root folder.
 # Both Emission and Excitation experiments are extracted (to separate masters) if present.
 	AUTOMATIC   = 'automatic'
-# Same as AUTOMATIC, but asks the user for a wavelength around which to normalize
+# Same as AUTOMATIC, but asks the user for wavelengths around which to normalize
 # and for an experiment type (this is done by LabTalk and passed as paramater to Python).
-# Only worksheets of the selected type are extracted.
+# Only worksheets of the selected type are extracted, every spectrum gives one column per wavelength.
 	INTERACTIVE = 'interactive'
 # Same as AUTOMATIC, but does not normalize, and uses a separate master sheet.
 	TITRATION   = 'titration'
@@ -41,6 +99,14 @@ class ExpType(Enum):
 	EXCITATION = 'Ex'
 	EMISSION   = 'Em'
 
+	@staticmethod
+	def from_note(experiment_type : str) -> ExpType:
+		# like build_long_name: everything but Emission is named as an excitation
+		return ExpType.EMISSION if experiment_type == 'Emission' else ExpType.EXCITATION
+
+# type of the worksheet pages, in PageInfo.type
+PGTYPE_WKS = PyOrigin.PGTYPE_WKS if PyOrigin is not None else 2
+
 
 
 def collections_count(self : CPyOriginCollectionBase) -> int:
@@ -52,20 +118,40 @@ def collections_count(self : CPyOriginCollectionBase) -> int:
 		count += 1
 	return count
 
-CPyOriginCollectionBase.GetCount = collections_count
+if PyOrigin is not None:
+	CPyOriginCollectionBase.GetCount = collections_count
+
+
+
+PageInfo = namedtuple('PageInfo', [
+	'name',
+	'long_name',
+	'type',
+	'creation_date',
+	'layers', # names of the layers, only listed for the pages of the active folder
+	          # (for the headless backend: NORMAL_LAYER_NAME, or BATCH_LAYER_NAME if there are several Y columns)
+	'exp_type', # ExpType read from the Note, None if the Note was not parsed (the type is then guessed from the names)
+], defaults = (None,))
+
+
+
+def is_master_name(long_name : str) -> bool:
+	# the prefix is followed by '_' (NORM_TN76_Em): worksheets named like FITC_water_... are not masters
+	return long_name.startswith(tuple(prefix + '_' for prefix in (PREFIX_NORM, PREFIX_BATCH, PREFIX_PROCESSED, PREFIX_FIT)))
 
 
 
-def is_valid_page(sheet : CPyPageBase):
-	long_name = sheet.GetLongName()
-	return (sheet.Type is PyOrigin.PGTYPE_WKS) and (not long_name.startswith(PREFIX_NORM)) and (not long_name.startswith(PREFIX_BATCH))
+def is_valid_page(page : PageInfo) -> bool:
+	return (page.type is PGTYPE_WKS) and (not is_master_name(page.long_name)) and (page.long_name != INDEX_LONG_NAME)
 
 
 
-def get_creation_date(page_short_name : str) -> datetime:
-	VAR_NAME = 'creation_date'
-	PyOrigin.LT_execute('string %s$=get_creation_date("%s")$;' % (VAR_NAME, page_short_name))
-	datestring = PyOrigin.LT_get_str(VAR_NAME)
+def format_creation_time(creation_date : Optional[datetime]) -> str:
+	return creation_date.strftime(CREATION_TIME_FORMAT) if creation_date is not None else ''
+
+
+
+def parse_creation_date(datestring : str) -> datetime:
 # format: "14/06/2023 07:44"
 	parts = datestring.split(' ')
 	(day, month, year) = [int(x) for x in parts[0].split('/')]
@@ -75,121 +161,796 @@ def get_creation_date(page_short_name : str) -> datetime:
 
 
 
-class Column:
-	def __init__(self, column_object : CPyColumn, x_start : int):
+def get_creation_dates(folders : Iterable[CPyFolder]) -> Dict[str, datetime]:
+	"""
+	Creation dates of every worksheet in the folders, indexed by short name.
+	They are all fetched by a single call to the OriginC function get_creation_dates()
+	The worksheets whose date cannot be read are reported and left out (their columns go after the others).
+	"""
+	VAR_NAME = 'creation_dates'
+	paths = '|'.join(folder.Path() for folder in folders)
+	PyOrigin.LT_execute('string %s$=get_creation_dates("%s")$;' % (VAR_NAME, paths))
+	records = PyOrigin.LT_get_str(VAR_NAME)
+# format: "Book1,14/06/2023 07:44;Book2,14/06/2023 07:46;"
+	dates = {}
+	for record in records.split(';'):
+		if record == '':
+			continue
+		(name, _, datestring) = record.rpartition(',') # the date has no ',', the name might
+		try:
+			dates[name] = parse_creation_date(datestring)
+		except (ValueError, IndexError): # PAGE_ERROR, INFO_ERROR or a date in another format
+			print("warning: the creation date of page '%s' cannot be read (%s), its columns go after the others" % (name, datestring))
+
+	return dates
+
+
+
+def walk_folders(folder : CPyFolder) -> List[CPyFolder]:
+	"""
+	The subfolders of the folder, recursively, each folder before its own subfolders.
+	"""
+	folders = []
+	for subfolder in folder.Folders():
+		folders.append(subfolder)
+		folders += walk_folders(subfolder)
+	return folders
+
+
+
+def read_pages(folder : CPyFolder, dates : Dict[str, datetime], with_layers : bool) -> List[PageInfo]:
+	pages = []
+	for pagebase in folder.PageBases():
+		(name, long_name, type_) = (pagebase.GetName(), pagebase.GetLongName(), pagebase.Type)
+		layers = ()
+		if with_layers and type_ is PGTYPE_WKS:
+			layers = tuple(layer.GetName() for layer in PyOrigin.Pages(name).Layers())
+		pages.append(PageInfo(name, long_name, type_, dates.get(name), layers))
+	return pages
+
+
+
+class ProjectSnapshot:
+	"""
+	Metadata of the pages of the active folder.
+	Everything is collected in a single pass, the rest of the script only reads from here.
+	"""
+	def __init__(self, folder_name : str, folder_path : str, folder_pages : List[PageInfo]) -> None:
+		self.folder_name = folder_name
+		self.folder_path = folder_path
+		self.folder_pages = folder_pages
+
+	@classmethod
+	def collect(cls, folder : CPyFolder) -> ProjectSnapshot:
+		return cls.collect_all([folder])[0]
+
+	@classmethod
+	def collect_all(cls, folders : List[CPyFolder]) -> List[ProjectSnapshot]:
 		"""
-		Extracts the data from a PyOrigin Column object into a ColumnData instance
+		Snapshots of several folders, the creation dates of all their pages are fetched at once.
 		"""
-		self.long_name = column_object.GetLongName()
-		self.comments =  column_object.GetComments()
-		rows =           column_object.GetData()
+		with profiling.phase('creation_dates'):
+			dates = get_creation_dates(folders)
 
-		self.rows = [x for x in rows if x != '']
-		offset = next(i for i, x in enumerate(rows) if x != '')
-		self.x_start = x_start + offset
-		self.x_end = x_start + len(self.rows) - 1
+		snapshots = []
+		with profiling.phase('folder_scan'):
+			for folder in folders:
+				folder_pages = read_pages(folder, dates, with_layers = True)
+				snapshots.append(cls(folder.GetName(), folder.Path(), folder_pages))
+		return snapshots
 
-	def write_column(self, col_object : CPyColumn) -> None:
-		col_object.SetComments(self.comments)
-		col_object.SetLongName(self.long_name)
-		col_object.SetUnits(Y_UNIT)
-		col_object.SetType(PyOrigin.COLTYPE_DESIGN_Y)
 
-		rows = self.rows
+
+class MasterIndex:
+	"""
+	Long name -> short name index of the master sheets of the project's root.
+	It is saved in a hidden worksheet of the root, so that masters are found without scanning the root.
+	Entries are checked when they are used, the index is rebuilt from a scan of the root only when
+	one of them turns out to be stale or missing.
+	"""
+	def __init__(self) -> None:
+		self.entries : Dict[str, str] = {}
+		self.scanned = False
+		self.modified = False
+
+		page = PyOrigin.Pages(INDEX_SHORT_NAME)
+		if page is not None and page.GetLongName() == INDEX_LONG_NAME:
+			sheet = page.Layers(0)
+			(long_names, short_names) = (sheet.Columns(0).GetData(), sheet.Columns(1).GetData())
+			self.entries = dict(zip(long_names, short_names))
+
+	def rebuild(self) -> None:
+		self.entries = {}
+		# the creation dates of the root pages are never used
+		with profiling.phase('root_scan'):
+			root_pages = read_pages(PyOrigin.GetRootFolder(), {}, with_layers = False)
+		# long names are not unique, the first page wins (like a linear search would)
+		for page in root_pages:
+			if page.type is PGTYPE_WKS and is_master_name(page.long_name):
+				self.entries.setdefault(page.long_name, page.name)
+		self.scanned = True
+		self.modified = True
+
+	def find(self, long_name : str) -> Optional[str]:
+		"""
+		Short name of the master sheet with this long name.
+		"""
+		short_name = self.entries.get(long_name)
+		if short_name is not None:
+			page = PyOrigin.Pages(short_name)
+			if page is not None and page.GetLongName() == long_name:
+				return short_name
+
+		if self.scanned:
+			return None
+
+		self.rebuild()
+		return self.entries.get(long_name)
+
+	def add(self, long_name : str, short_name : str) -> None:
+		self.entries[long_name] = short_name
+		self.modified = True
+
+	def save(self) -> None:
+		"""
+		Writes the index back to its hidden worksheet, must be called from the project's root.
+		"""
+		if not self.modified:
+			return
+
+		page = PyOrigin.Pages(INDEX_SHORT_NAME)
+		if page is None or page.GetLongName() != INDEX_LONG_NAME:
+			page = PyOrigin.CreatePage(PyOrigin.PGTYPE_WKS, INDEX_SHORT_NAME, "", 1)
+			page.SetLongName(INDEX_LONG_NAME)
+			PyOrigin.LT_execute('win -a %s; win -h 1;' % page.GetName())
+
+		sheet = page.Layers(0)
+		if sheet.GetColCount() < 2:
+			sheet.SetColCount(2)
+		sheet.Columns(0).SetData(list(self.entries.keys()))
+		sheet.Columns(1).SetData(list(self.entries.values()))
+		self.modified = False
+
+
+
+class Column:
+	def __init__(self, long_name : str, comments : str, rows : list, x_start : int, creation_time : str = ''):
+		"""
+		Holds the data of a column, as read from a worksheet (blank cells are empty strings)
+		creation_time is that of the worksheet (CREATION_TIME_FORMAT), it orders the columns of the masters.
+		"""
+		self.long_name = long_name
+		self.comments =  comments
+		self.creation_time = creation_time
+
+		try:
+			self.values = np.asarray(rows, dtype = SPECTRUM_DTYPE)
+			offset = 0
+		except ValueError:
+		# the column contains empty cells (''): those before and after the spectrum are dropped, those inside are NaN
+			rows = np.asarray(rows, dtype = object)
+			filled = np.flatnonzero(rows != '')
+			(offset, end) = (int(filled[0]), int(filled[-1]) + 1) if len(filled) > 0 else (0, 0)
+			rows = rows[offset:end]
+			rows[rows == ''] = np.nan
+			self.values = rows.astype(SPECTRUM_DTYPE)
+
+		self.x_start = x_start + offset * X_STEP
+		self.x_end = self.x_start + (len(self.values) - 1) * X_STEP
+
+	def index(self, wavelength : float) -> int:
+		"""
+		Index of the value at this wavelength (the nearest row of the grid).
+		"""
+		return int(round((wavelength - self.x_start) / X_STEP))
+
+	def padded_rows(self) -> list:
+		"""
+		The rows of the column, starting at X_START.
+		"""
 	# it is critical to insert empty strings in the empty cells
 	# because of a bug in the GetData(start, end) function --> it returns a list
 	# filled with None if the (start, end) range contains empty cells
 	# at the beginning
+		padding = grid_index(self.x_start)
+		if padding <= 0:
+			return self.values.tolist()
 
-		if self.x_start > X_START:
-			rows = [''] * (self.x_start - X_START) + rows
+		rows = np.full(padding + len(self.values), '', dtype = object)
+		rows[padding:] = self.values
+		return rows.tolist()
 
-		col_object.SetData(rows)
+	def write_column(self, col_object : CPyColumn) -> None:
+		col_object.SetComments(self.comments)
+		col_object.SetLongName(self.long_name)
+		col_object.SetUnits(Y_UNIT)
+		col_object.SetType(PyOrigin.COLTYPE_DESIGN_Y)
+		col_object.SetData(self.padded_rows())
 
 	def normalize(self):
-		if len(self.rows) == 0:
+		if len(self.values) == 0:
 			return
 
-		min_val = min(self.rows)
+		min_val = np.nanmin(self.values)
+		max_val = np.nanmax(self.values)
+
+		self.values -= min_val
+		self.values /= max_val - min_val
 
-		if MODE is Mode.INTERACTIVE:
-			if self.x_start > NORM_WAVELENGTH or self.x_end < NORM_WAVELENGTH:
-				raise IndexError(
-					'column %s has range (%d, %d)nm but you selected a normalizing wavelength of %d' %
-					(self.long_name, self.x_start, self.x_end, NORM_WAVELENGTH)
+	def normalized_at(self, wavelengths : List[int]) -> Dict[int, Column]:
+		"""
+		Copies of the column normalized to 1 at each of the wavelengths (INTERACTIVE mode), computed together.
+		The wavelengths out of the range of the column are reported and skipped.
+		"""
+		if len(self.values) == 0:
+			return {wavelength : copy.copy(self) for wavelength in wavelengths}
+
+		in_range = []
+		for wavelength in wavelengths:
+			if self.x_start <= wavelength <= self.x_end:
+				in_range.append(wavelength)
+			else:
+				print('error: column %s has range (%d, %d)nm but you selected a normalizing wavelength of %d, it is skipped' %
+					(self.long_name, self.x_start, self.x_end, wavelength)
 				)
-			max_val = self.rows[NORM_WAVELENGTH - self.x_start]
-		else:
-			max_val = max(self.rows)
+		if len(in_range) == 0:
+			return {}
+
+		min_val = np.nanmin(self.values)
+		max_vals = self.values[[self.index(wavelength) for wavelength in in_range]]
+		# one row per wavelength
+		rows = (self.values - min_val)[np.newaxis, :] / (max_vals - min_val)[:, np.newaxis]
+
+		variants = {}
+		for wavelength, values in zip(in_range, rows):
+			variants[wavelength] = copy.copy(self)
+			variants[wavelength].values = values
+		return variants
+
+
+
+def grid_wavelengths() -> np.ndarray:
+	"""
+	The X column of the masters: X_START to X_END every X_STEP.
+	"""
+	return X_START + X_STEP * np.arange(int(round((X_END - X_START) / X_STEP)) + 1)
+
+
+
+def grid_index(wavelength : float) -> int:
+	return int(round((wavelength - X_START) / X_STEP))
+
+
+
+def is_on_grid(x_values : np.ndarray) -> bool:
+	"""
+	Whether the spectrum is sampled on the grid of the masters (every X_STEP, from a wavelength of the grid).
+	"""
+	offset = (x_values[0] - X_START) / X_STEP
+	return abs(offset - round(offset)) < 1e-6 and bool(np.allclose(np.diff(x_values), X_STEP))
+
+
+
+def resample(x_values : np.ndarray, matrix : np.ndarray) -> Tuple[float, np.ndarray]:
+	"""
+	Maps spectra sampled at x_values (the columns of matrix, one row per spectrum, NaN for the empty cells)
+	onto the grid of the masters, all at once. The spectra finer than the grid are averaged over each cell
+	of the grid, the others are interpolated linearly.
+	Returns (first wavelength, rows from it on the grid).
+	"""
+	order = np.argsort(x_values)
+	(x_values, matrix) = (x_values[order], matrix[:, order])
+	grid = grid_wavelengths()
+	grid = grid[(grid >= x_values[0] - X_STEP / 2) & (grid <= x_values[-1] + X_STEP / 2)]
+	if len(grid) == 0 or len(x_values) < 2:
+		return (X_START, np.empty((len(matrix), 0)))
+
+	if np.median(np.diff(x_values)) < X_STEP:
+		# weighted sums over the points of every cell [x - X_STEP / 2, x + X_STEP / 2], from cumulative sums:
+		# the points on an edge are shared by the two cells and count half in each, so that the cells stay centred
+		# (with half-open cells, a spectrum every 0.5 nm would be shifted by 0.25 nm to the blue)
+		tolerance = X_STEP * 1e-6
+		(lower_edge, upper_edge) = (grid - X_STEP / 2, grid + X_STEP / 2)
+		bounds = [np.searchsorted(x_values, edge) for edge in (lower_edge - tolerance, lower_edge + tolerance, upper_edge - tolerance, upper_edge + tolerance)]
+		missing = np.isnan(matrix)
+		sums   = np.concatenate([np.zeros((len(matrix), 1)), np.cumsum(np.where(missing, 0.0, matrix), axis = 1)], axis = 1)
+		counts = np.concatenate([np.zeros((len(matrix), 1)), np.cumsum(~missing, axis = 1)], axis = 1)
+
+		def weighted(cumulative : np.ndarray) -> np.ndarray:
+			(lower_start, lower_end, upper_start, upper_end) = (cumulative[:, bound] for bound in bounds)
+			return (upper_start - lower_end) + ((lower_end - lower_start) + (upper_end - upper_start)) / 2
+
+		with np.errstate(invalid = 'ignore', divide = 'ignore'):
+			rows = weighted(sums) / weighted(counts)
+	else:
+		grid = grid[(grid >= x_values[0]) & (grid <= x_values[-1])]
+		left = np.clip(np.searchsorted(x_values, grid, side = 'right') - 1, 0, len(x_values) - 2)
+		weights = (grid - x_values[left]) / (x_values[left + 1] - x_values[left])
+		# the points of the grid that were measured are copied (their empty neighbours do not matter)
+		rows = np.where(weights == 0, matrix[:, left], matrix[:, left] * (1 - weights) + matrix[:, left + 1] * weights)
+
+	return (grid[0] if len(grid) > 0 else X_START, rows)
+
+
+
+def assemble_block(columns : List[Column]) -> list:
+	"""
+	The columns on the shared grid starting at X_START, as a list of columns of the same length
+	(empty strings where a column has no data, see Column.padded_rows)
+	"""
+	starts = [max(grid_index(column.x_start), 0) for column in columns]
+	rows_count = max([len(grid_wavelengths())] + [start + len(column.values) for start, column in zip(starts, columns)])
+
+	block = np.full((len(columns), rows_count), '', dtype = object)
+	for row, start, column in zip(block, starts, columns):
+		row[start : start + len(column.values)] = column.values
+	return block.tolist()
+
+
+
+def insertion_order(count : int, positions : List[int]) -> List[int]:
+	"""
+	The order of the columns of a master once the columns appended after its count columns are moved
+	before the existing columns at their positions (in increasing order), as indexes of the current columns.
+	"""
+	order = []
+	new_columns = iter(enumerate(positions, count))
+	(new_index, position) = next(new_columns, (None, None))
+	for index in range(count + 1):
+		while position is not None and position <= index:
+			order.append(new_index)
+			(new_index, position) = next(new_columns, (None, None))
+		if index < count:
+			order.append(index)
+	return order
+
 
-		self.rows = [(x - min_val) / (max_val - min_val) for x in self.rows]
+
+def block_moves(order : List[int]) -> List[Tuple[int, int]]:
+	"""
+	The blocks of adjacent columns to move to the end, one after the other, to put the columns in this order:
+	(first, last) indexes of each block, when it is moved.
+	"""
+	current = list(range(len(order)))
+	moves = []
+	# the columns before the first one out of place stay
+	start = next((i for i, index in enumerate(order) if index != i), len(order))
+	while start < len(order):
+		end = start + 1
+		while end < len(order) and order[end] == order[end - 1] + 1:
+			end += 1
+		first = current.index(order[start])
+		last = first + end - start - 1
+		moves.append((first, last))
+		current = current[:first] + current[last + 1:] + current[first : last + 1]
+		start = end
+	return moves
+
+
+
+def trim_missing(row : np.ndarray) -> list:
+	"""
+	The row with empty strings instead of its leading NaN (see Column), without its trailing NaN.
+	"""
+	filled = np.flatnonzero(~np.isnan(row))
+	if len(filled) == 0:
+		return []
+	rows = row[:filled[-1] + 1].astype(object)
+	rows[:filled[0]] = ''
+	return rows.tolist()
 
 
 
 class WorkSheet:
-	def __init__(self, page : CPyWorksheetPage) -> None:
-		self.name = page.GetName()
-		self.long_name = page.GetLongName()
-		self.creation_date = get_creation_date(self.name)
-
-		worksheet = page.Layers(LAYER_NAME)
-		if worksheet is None:
-			print("error: page '%s' ('%s') does not have a %s layer" % (self.long_name, self.name, LAYER_NAME))
+	"""
+	A worksheet of the active folder.
+	The target long names of its columns are computed from the metadata only,
+	the data is read (by read_columns) just for the columns that are not in the master yet.
+	"""
+	def __init__(self, info : PageInfo, backend : Backend) -> None:
+		self.info = info
+		self.name = info.name
+		self.long_name = info.long_name
+		self.creation_date = info.creation_date
+		self.backend = backend
+		self._column_names = None
+
+	def column_names(self) -> Dict[str, int]:
+		"""
+		The long names the columns will have in the master, mapped to their index in the worksheet.
+		"""
+		if self._column_names is None:
+			if MODE is Mode.BATCH:
+				self._column_names = {
+					self.long_name + '-' + str(i) : i
+					for i in range(1, self.backend.column_count(self.info))
+				}
+			elif MODE is Mode.INTERACTIVE:
+				self._column_names = {self.interactive_name(wavelength) : 1 for wavelength in NORM_WAVELENGTHS}
+			else:
+				self._column_names = {self.long_name : 1}
+
+		return self._column_names
+
+	def interactive_name(self, wavelength : int) -> str:
+		return self.long_name + '__(%d)' % wavelength
+
+	def read_columns(self, names : List[str]) -> List[Column]:
+		"""
+		Reads the columns with these (master) long names.
+		"""
+		with profiling.phase('read_columns', page = self.name):
+			x_values = np.asarray([x for x in self.backend.read_x(self.info) if x != ''], dtype = float)
+			(x_start, x_end) = x_values[0], x_values[-1]
+
+			print("page '%s' ( '%s' ) created %s has range (%g, %g) nm" %
+				(self.name, self.long_name, self.creation_date, x_start, x_end)
+			)
+
+			indexes = self.column_names()
+			read = [(index, self.backend.read_column(self.info, index)) for index in dict.fromkeys(indexes[name] for name in names)] # every column is read once
+
+			if not is_on_grid(x_values):
+				print("page '%s' is sampled every %g nm, it is resampled every %g nm" % (self.name, np.median(np.diff(x_values)), X_STEP))
+				with profiling.phase('resample'):
+					matrix = np.full((len(read), len(x_values)), np.nan)
+					for row, (_, (_, _, rows)) in zip(matrix, read):
+						rows = np.asarray(rows[:len(x_values)], dtype = object)
+						rows[rows == ''] = np.nan
+						row[:len(rows)] = rows.astype(float)
+					(x_start, matrix) = resample(x_values, matrix)
+					read = [(index, (long_name, comments, trim_missing(row))) for (index, (long_name, comments, _)), row in zip(read, matrix)]
+
+			columns = []
+			for index, (long_name, comments, rows) in read:
+				column = Column(long_name, comments, rows, x_start, format_creation_time(self.creation_date))
+
+				if MODE is Mode.INTERACTIVE:
+					wavelengths = [wavelength for wavelength in NORM_WAVELENGTHS if self.interactive_name(wavelength) in names]
+					with profiling.phase('normalize'):
+						variants = column.normalized_at(wavelengths)
+					variants = {self.interactive_name(wavelength) : variant for wavelength, variant in variants.items()}
+				else:
+					if MODE is Mode.AUTOMATIC:
+						with profiling.phase('normalize'):
+							column.normalize()
+					variants = {name : column for name in names if indexes[name] == index}
+
+				for name in names:
+					if name in variants:
+						variants[name].long_name = name
+						columns.append(variants[name])
+
+		return columns
+
+
+
+class MasterSheetWriter:
+	"""
+	Adds columns to a master sheet.
+	The long names already present in the master are read once and kept in a set,
+	so the columns of every worksheet are collected first and then inserted as one block.
+	The columns of the master are kept in the order of the creation of their worksheets:
+	the new columns are appended when they are the most recent (the usual case), otherwise they are appended
+	and moved before the first existing column that is more recent (the existing columns are not rewritten).
+	flush can be called after every worksheet (see STREAM_BATCH): the labels of the master are only read once.
+	"""
+	def __init__(self, master_sheet : MasterSheet) -> None:
+		self.master_sheet = master_sheet
+		self.existing_names = set(master_sheet.long_names())
+		self.times : Optional[List[str]] = None # read by the first flush that has columns to write
+		self.pending : List[Column] = []
+
+	def add(self, worksheet : WorkSheet) -> None:
+		"""
+		Reads and queues the columns of the worksheet that are not in the master yet.
+		"""
+		names = [name for name in worksheet.column_names() if name not in self.existing_names]
+		if len(names) == 0:
 			return
 
-		x_column = worksheet.Columns(0)
-		x_values = x_column.GetData(0)
-		self.x_start, self.end_x = int(x_values[0]), int(x_values[-1])
+		self.existing_names.update(names)
+		self.pending.extend(worksheet.read_columns(names))
 
-		self.y_columns = []
+	def queue(self, columns : List[Column]) -> None:
+		"""
+		Queues columns that were already read (the processed columns of another master).
+		"""
+		columns = [column for column in columns if column.long_name not in self.existing_names]
+		self.existing_names.update(column.long_name for column in columns)
+		self.pending.extend(columns)
 
-		if MODE is Mode.BATCH:
-			for i in range(1, worksheet.GetColCount()):
-				column = Column(worksheet.Columns(i), self.x_start)
-				column.long_name = self.long_name + '-' + str(i)
-				self.y_columns.append(column)
+	def flush(self) -> List[Column]:
+		"""
+		Inserts the queued columns, returns them.
+		"""
+		columns = self.pending
+		self.pending = []
+		if len(columns) == 0:
+			return []
+
+		# the new columns are in chronological order (see make_master_sheet), the existing ones should be too
+		# (older masters have no creation times: their columns stay first)
+		if self.times is None:
+			self.times = list(self.master_sheet.creation_times())
+		times = self.times
+		if len(times) == 0: # new master: its X column comes first
+			times.append('')
+		# index of the existing column each new column goes before, for equal times the existing columns stay first
+		# (the columns without a creation time, last in columns, go at the end)
+		positions = [bisect.bisect_right(times, column.creation_time, 1) if column.creation_time != '' else len(times) for column in columns]
+
+		if columns[0].creation_time == '' or positions[0] == len(times):
+			positions = [len(times)] * len(columns)
+			with profiling.phase('append'):
+				self.master_sheet.append(columns)
 		else:
-			column = Column(worksheet.Columns(1), self.x_start)
-			if MODE is not Mode.TITRATION:
-				column.normalize()
-			column.long_name = self.long_name
-			if MODE is Mode.INTERACTIVE:
-				column.long_name += '__(%d)' % NORM_WAVELENGTH
+			with profiling.phase('merge'):
+				print('%d columns of the master are moved after the new columns' % (len(times) - positions[0]))
+				self.master_sheet.insert(positions, columns)
+
+		for offset, (position, column) in enumerate(zip(positions, columns)):
+			times.insert(position + offset, column.creation_time)
+		return columns
+
 
-			self.y_columns.append(column)
 
-	def append_to_master_sheet(self, master_sheet : CPyWorksheet) -> None:
+class MasterSheet:
+	"""
+	A master sheet, as seen by MasterSheetWriter.
+	"""
+	def long_names(self) -> List[str]:
+		raise NotImplementedError
+
+	def creation_times(self) -> List[str]:
 		"""
-		Appends the columns into the master sheet.
+		The creation times (CREATION_TIME_FORMAT) of the worksheets the columns come from, '' if unknown.
 		"""
-		master_column_names = [col.GetLongName() for col in master_sheet.Columns()]
-		columns = [column for column in self.y_columns if column.long_name not in master_column_names]
+		raise NotImplementedError
 
-		if len(columns) == 0:
-			return
+	def append(self, columns : List[Column]) -> None:
+		"""
+		Appends the columns after the existing ones, creates the X column first if the master is empty.
+		"""
+		raise NotImplementedError
 
-		columns_count = master_sheet.GetColCount()
-		if columns_count == 0:
-		# creating the first (x) column
-			master_sheet.InsertCol(0, X_NAME)
-			x_column = master_sheet.Columns(0)
-			x_column.SetUnits(X_UNIT)
-			x_column.SetLongName(X_NAME)
-			x_column.SetType(PyOrigin.COLTYPE_DESIGN_X)
-			x_column.SetData(list(range(X_START, X_END + 1)))
-			columns_count = 1
+	def read(self, first : int) -> List[Column]:
+		"""
+		The columns from index first (> 0) to the end.
+		"""
+		raise NotImplementedError
 
-		# inserting the next (y) columns
-		for i, column_data in enumerate(columns, columns_count):
-			master_sheet.InsertCol(i, 'Y' + str(i))
-			y_column = master_sheet.Columns(i)
-			column_data.write_column(y_column)
+	def insert(self, positions : List[int], columns : List[Column]) -> None:
+		"""
+		Inserts each column before the existing column at its position (> 0, in increasing order),
+		the existing columns are moved, not rewritten.
+		"""
+		raise NotImplementedError
 
 
 
-def extract_folder(folder : CPyFolder) -> Dict[ExpType, List[WorkSheet]]:
+class Backend:
 	"""
-	Extracts the individual worksheets from a folder.
+	The I/O of the pipeline.
+	OriginBackend works on the open project through PyOrigin, headless.FileSystemBackend on exported spectra.
+	"""
+	def column_count(self, page : PageInfo) -> int:
+		"""
+		Number of columns of the LAYER_NAME layer of the page, X column included.
+		"""
+		raise NotImplementedError
+
+	def read_x(self, page : PageInfo) -> list:
+		raise NotImplementedError
+
+	def read_column(self, page : PageInfo, index : int) -> Tuple[str, str, list]:
+		"""
+		(long name, comments, rows) of a column of the LAYER_NAME layer of the page.
+		"""
+		raise NotImplementedError
+
+	def open_master(self, exp_type : ExpType, prefix : str, long_name : str) -> MasterSheet:
+		"""
+		Finds the master sheet with this long name, creates it if there is none.
+		"""
+		raise NotImplementedError
+
+	def release(self, page : PageInfo) -> None:
+		"""
+		The columns of the page have been written to the master, what is held to read them can be dropped.
+		"""
+		pass
+
+	def close(self) -> None:
+		pass
+
+
+
+class OriginMasterSheet(MasterSheet):
+	def __init__(self, worksheet : CPyWorksheet) -> None:
+		self.worksheet = worksheet
+		self.creation_times_shown = False
+
+	def long_names(self) -> List[str]:
+		return self.worksheet.GetLabels('L')
+
+	def creation_times(self) -> List[str]:
+		return self.worksheet.GetLabels(CREATION_TIME_ROW)
+
+	def append(self, columns : List[Column]) -> None:
+		self.write(self.worksheet.GetColCount(), columns)
+
+	def read(self, first : int) -> List[Column]:
+		master_sheet = self.worksheet
+		labels = [master_sheet.GetLabels(row) for row in ('L', 'C', CREATION_TIME_ROW)]
+
+		columns = []
+		for i in range(first, master_sheet.GetColCount()):
+			(long_name, comments, creation_time) = (row[i] for row in labels)
+			columns.append(Column(long_name, comments, master_sheet.Columns(i).GetData(), X_START, creation_time))
+		return columns
+
+	def insert(self, positions : List[int], columns : List[Column]) -> None:
+		count = self.worksheet.GetColCount()
+		self.append(columns)
+		# the new columns are now at the end, they are moved into place by blocks of columns (see insertion_order)
+		moves = ['win -a %s' % self.worksheet.GetPage().GetName()]
+		for first, last in block_moves(insertion_order(count, positions)):
+			moves.append('colmove cols:=col(%d):col(%d) operation:=last' % (first + 1, last + 1))
+		PyOrigin.LT_execute(';'.join(moves) + ';')
+
+	def write(self, first : int, columns : List[Column]) -> None:
+		if not self.creation_times_shown: # once, the master can be written after every worksheet
+			self.show_creation_times()
+			self.creation_times_shown = True
+		if BLOCK_WRITE:
+			self.write_block(first, columns)
+		else:
+			self.write_columns(first, columns)
+
+	def show_creation_times(self) -> None:
+		# a user parameter row only appears once it has a name (masters made before the row was added get it here)
+		PyOrigin.LT_execute('win -a %s; wks.userParam%s = 1; wks.userParam%s$ = "%s";' %
+			(self.worksheet.GetPage().GetName(), CREATION_TIME_ROW[1:], CREATION_TIME_ROW[1:], CREATION_TIME_LABEL)
+		)
+
+	def write_block(self, first : int, columns : List[Column]) -> None:
+		"""
+		Writes the data of all the columns (and of the X column of a new master) in one call,
+		then sets their labels one row at a time.
+		"""
+		master_sheet = self.worksheet
+
+		with profiling.phase('write_data'):
+			block = assemble_block(columns)
+			if first == 0:
+				x_values = grid_wavelengths().tolist()
+				block.insert(0, x_values + [''] * (len(block[0]) - len(x_values)))
+
+			master_sheet.SetColCount(first + len(block))
+			master_sheet.SetData(block, 0, first)
+
+		with profiling.phase('set_labels'):
+			long_names = [column.long_name for column in columns]
+			units = [Y_UNIT] * len(columns)
+			comments = [column.comments for column in columns]
+			creation_times = [column.creation_time for column in columns]
+			designations = 'Y' * len(columns)
+			if first == 0:
+				(long_names, units, comments) = ([X_NAME] + long_names, [X_UNIT] + units, [''] + comments)
+				creation_times = [''] + creation_times
+				designations = 'X' + designations
+
+			master_sheet.SetColDesignations(designations, first, False)
+			master_sheet.SetLabels(long_names,     'L', first)
+			master_sheet.SetLabels(units,          'U', first)
+			master_sheet.SetLabels(comments,       'C', first)
+			master_sheet.SetLabels(creation_times, CREATION_TIME_ROW, first)
+
+	def write_columns(self, first : int, columns : List[Column]) -> None:
+		master_sheet = self.worksheet
+		with profiling.phase('insert_columns'):
+			if first == 0:
+			# creating the first (x) column
+				master_sheet.InsertCol(0, X_NAME)
+				x_column = master_sheet.Columns(0)
+				x_column.SetUnits(X_UNIT)
+				x_column.SetLongName(X_NAME)
+				x_column.SetType(PyOrigin.COLTYPE_DESIGN_X)
+				x_column.SetData(grid_wavelengths().tolist())
+				first = 1
+
+			# inserting the next (y) columns in one go, then their labels one row at a time
+			master_sheet.SetColCount(first + len(columns))
+			master_sheet.SetColDesignations('Y' * len(columns), first, False)
+			master_sheet.SetLabels([column.long_name for column in columns],     'L', first)
+			master_sheet.SetLabels([Y_UNIT] * len(columns),                       'U', first)
+			master_sheet.SetLabels([column.comments for column in columns],      'C', first)
+			master_sheet.SetLabels([column.creation_time for column in columns], CREATION_TIME_ROW, first)
+
+		with profiling.phase('write_data'):
+			# padded to the whole grid, like the block of write_block
+			for i, rows in enumerate(assemble_block(columns), first):
+				master_sheet.Columns(i).SetData(rows)
+
+
+
+class OriginBackend(Backend):
+	def __init__(self) -> None:
+		self.layers : Dict[str, CPyWorksheet] = {}
+		self.index : Optional[MasterIndex] = None
+
+	def layer(self, page : PageInfo) -> CPyWorksheet:
+		if page.name not in self.layers:
+			self.layers[page.name] = PyOrigin.Pages(page.name).Layers(LAYER_NAME)
+		return self.layers[page.name]
+
+	def column_count(self, page : PageInfo) -> int:
+		return self.layer(page).GetColCount()
+
+	def read_x(self, page : PageInfo) -> list:
+		return self.layer(page).Columns(0).GetData(0)
+
+	def read_column(self, page : PageInfo, index : int) -> Tuple[str, str, list]:
+		column = self.layer(page).Columns(index)
+		return (column.GetLongName(), column.GetComments(), column.GetData())
+
+	def release(self, page : PageInfo) -> None:
+		self.layers.pop(page.name, None)
+
+	def open_master(self, exp_type : ExpType, prefix : str, long_name : str) -> MasterSheet:
+		with profiling.phase('open_master'):
+			return self.find_or_create_master(exp_type, prefix, long_name)
+
+	def open_index(self) -> MasterIndex:
+		if self.index is None:
+			# moving to the project's root so that we can create sheets there
+			PyOrigin.XF('pe_cd', {'path' : '/'})
+			self.index = MasterIndex()
+		return self.index
+
+	def master_names(self, prefix : str) -> List[str]:
+		"""
+		Long names of the master sheets of the project's root whose prefix is this one (the root is scanned).
+		"""
+		index = self.open_index()
+		index.rebuild()
+		return [long_name for long_name in index.entries if long_name.startswith(prefix + '_')]
+
+	def find_or_create_master(self, exp_type : ExpType, prefix : str, long_name : str) -> MasterSheet:
+		self.open_index()
+
+# - short names are silently truncated to 12 chars, special chars such as '-', '_' are silently removed
+# - Pages() only works with short names, because they're unique per project, whereas long names are not
+# --> the index maps the long name to the short name
+
+		short_name = self.index.find(long_name)
+
+		if short_name is not None:
+			print("found master sheet in the project's root with short name '%s' and long name '%s'" 
+				% (short_name, long_name)
+			)
+			master_sheet = PyOrigin.Pages(short_name).Layers(NORMAL_LAYER_NAME)
+		else:
+			master_sheet = create_worksheet(exp_type.value + prefix, long_name)
+			short_name = master_sheet.GetPage().GetName()
+			self.index.add(long_name, short_name)
+			print("created master sheet in the project's root with short name '%s' and long name '%s'"
+				% (short_name, long_name)
+			)
+
+		return OriginMasterSheet(master_sheet)
+
+	def close(self) -> None:
+		if self.index is not None:
+			with profiling.phase('save_index'):
+				self.index.save()
+
+
+
+def extract_folder(snapshot : ProjectSnapshot, backend : Backend) -> Dict[ExpType, List[WorkSheet]]:
+	"""
+	Sorts the worksheets of a folder by experiment type, without reading their data.
 	"""
 
 	worksheets = {
@@ -197,24 +958,23 @@ def extract_folder(folder : CPyFolder) -> Dict[ExpType, List[WorkSheet]]:
 		ExpType.EXCITATION : []
 	}
 
-	for pagebase in folder.PageBases():
-		if not is_valid_page(pagebase):
+	for info in snapshot.folder_pages:
+		if not is_valid_page(info):
 			continue
 
-		(page_name, page_longname) = (pagebase.GetName(), pagebase.GetLongName())
+		(page_name, page_longname) = (info.name, info.long_name)
 
-		exp_type = ExpType.EXCITATION if 'Ex' in page_name or 'Ex' in page_longname else ExpType.EMISSION
+		exp_type = info.exp_type
+		if exp_type is None:
+			exp_type = ExpType.EXCITATION if 'Ex' in page_name or 'Ex' in page_longname else ExpType.EMISSION
 		if MODE is Mode.INTERACTIVE and exp_type is not EXP_TYPE:
 			continue
 
-		page = PyOrigin.Pages(page_name)
-		worksheet = WorkSheet(page)
-
-		print("page '%s' ( '%s' ) created %s has range (%d, %d) nm" %
-			(page_name, page_longname, worksheet.creation_date, worksheet.x_start, worksheet.end_x)
-		)
+		if LAYER_NAME not in info.layers:
+			print("error: page '%s' ('%s') does not have a %s layer" % (page_longname, page_name, LAYER_NAME))
+			continue
 
-		worksheets[exp_type].append(worksheet)
+		worksheets[exp_type].append(WorkSheet(info, backend))
 
 	return worksheets
 
@@ -235,65 +995,155 @@ def create_worksheet(short_name : str, long_name : str) -> CPyWorksheet:
 
 
 
-def make_master_sheet(exp_type : ExpType, prefix : str, data : Dict[ExpType, List[WorkSheet]]) -> None:
+def make_master_sheet(exp_type : ExpType, prefix : str, data : Dict[ExpType, List[WorkSheet]], backend : Backend) -> Dict[str, int]:
+	"""
+	Appends the worksheets of this type to their master (and their processed copies to the PREFIX_PROCESSED master
+	if PROCESSING is set), returns {long name of the master : number of new columns}
+	"""
 	worksheets = data[exp_type]
 	if len(worksheets) == 0: # we do not create a master sheet if there is no data
-		return
+		return {}
 
-	# sorting the columns by long name (we want to do that *before* appending to the master sheets):
-	worksheets.sort(key = lambda sheet : sheet.creation_date)
+	# sorting the columns by creation date (we want to do that *before* appending to the master sheets),
+	# the worksheets without a date go last:
+	worksheets.sort(key = lambda sheet : (sheet.creation_date is None, sheet.creation_date or datetime.min))
 
 	start = PREFIX_BATCH if MODE is Mode.BATCH or MODE is Mode.TITRATION else PREFIX_NORM
 	long_name = start + '_' + prefix
 	if MODE is Mode.AUTOMATIC or MODE is Mode.INTERACTIVE:
 		long_name += '_' + exp_type.value
 
-# - short names are silently truncated to 12 chars, special chars such as '-', '_' are silently removed
-# - Pages() only works with short names, because they're unique per project, whereas long names are not
-# --> we have to search for the long name, then get the short name
-
-	page = next((
-		page for page in PyOrigin.GetRootFolder().PageBases()
-		if page.GetLongName() == long_name
-	), None)
+	processed_long_name = PREFIX_PROCESSED + '_' + long_name
+	added = {long_name : 0}
+	processed_writer = None
+
+	def open_processed() -> MasterSheetWriter:
+		nonlocal processed_writer
+		if processed_writer is None: # opened (created) once there is something to write
+			processed_writer = MasterSheetWriter(backend.open_master(exp_type, PREFIX_PROCESSED + prefix, processed_long_name))
+		return processed_writer
+
+	def process(columns : List[Column]) -> None:
+		with profiling.phase('process'):
+			processed = open_processed()
+			processed.queue(PROCESSING.apply(columns))
+			added[processed_long_name] = added.get(processed_long_name, 0) + len(processed.flush())
+
+	def flush() -> None:
+		columns = writer.flush()
+		added[long_name] += len(columns)
+		if len(columns) == 0:
+			return
 
-	if page is not None:
-		short_name = page.GetName()
-		print("found master sheet in the project's root with short name '%s' and long name '%s'" 
-			% (short_name, long_name)
-		)
-		master_sheet = PyOrigin.Pages(short_name).Layers(NORMAL_LAYER_NAME)
+		if EXPORT is not None:
+			with profiling.phase('export'):
+				EXPORT.append(long_name, columns, MODE.value)
+		if PROCESSING is not None:
+			process(columns)
+
+	writer = MasterSheetWriter(backend.open_master(exp_type, prefix, long_name))
+	if PROCESSING is not None and len(writer.existing_names - {X_NAME}) > 0:
+		# the columns of the master that are not in the processed master yet (e.g. the first run with PROCESS_OPTION
+		# on an existing master) are processed first, in the order of the master
+		missing = writer.existing_names - open_processed().existing_names - {X_NAME}
+		if len(missing) > 0:
+			columns = [column for column in writer.master_sheet.read(1) if column.long_name in missing]
+			print('%d columns of the master are not in %s yet, they are processed' % (len(columns), processed_long_name))
+			process(columns)
+
+	if MODE is Mode.BATCH and STREAM_BATCH:
+		# one worksheet at a time, in the order of creation: its columns are read, written and released
+		for worksheet in worksheets:
+			writer.add(worksheet)
+			flush()
+			backend.release(worksheet.info)
 	else:
-		master_sheet = create_worksheet(exp_type.value + prefix, long_name)
-		short_name = master_sheet.GetPage().GetName()
-		print("created master sheet in the project's root with short name '%s' and long name '%s'"
-			% (short_name, long_name)
-		)
+		for worksheet in worksheets:
+			writer.add(worksheet)
+		flush()
 
-	cols_count = master_sheet.GetColCount()
+	if added[long_name] == 0:
+		print('All columns already existed in the master.')
+	return added
 
-	for worksheet in worksheets:
-		worksheet.append_to_master_sheet(master_sheet)
+def detect_batch_mode(snapshot : ProjectSnapshot) -> bool:
+	page = next((info for info in snapshot.folder_pages if is_valid_page(info)), None)
+	return page is not None and BATCH_LAYER_NAME in page.layers
 
-	if master_sheet.GetColCount() == cols_count:
-		print('All columns already existed in the master.')
 
-def detect_batch_mode() -> bool:
-	folder = PyOrigin.ActiveFolder()
-	pagebases = (pagebase for pagebase in folder.PageBases() if is_valid_page(pagebase))
-	pages = (PyOrigin.Pages(pagebase.GetName()) for pagebase in pagebases)
 
-	try:
-		page = next(pages)
-		return page.Layers(BATCH_LAYER_NAME) is not None
-	except StopIteration:
-		return False
+def parse_wavelengths(string : str) -> List[int]:
+	"""
+	"380 400, 420" -> [380, 400, 420], raises a ValueError naming the field that is not a whole number of nm.
+	"""
+	wavelengths = []
+	for field in re.split('[\\s,;]+', string.strip()):
+		if field == '':
+			continue
+		try:
+			wavelengths.append(int(field))
+		except ValueError:
+			raise ValueError("'%s' in the wavelengths field (%s) is not a wavelength, give whole numbers of nm separated by spaces" % (field, string)) from None
+	if len(wavelengths) == 0:
+		raise ValueError('the wavelengths field is empty, give the wavelengths to normalize at (e.g. "400 450")')
+	return wavelengths
 
 
 
-def main():
-	folder = PyOrigin.ActiveFolder()
-	folder_name = folder.GetName() # folders do not have long names
+def configure(mode : Mode, norm_wavelengths : Optional[List[int]] = None, exp_type : Optional[ExpType] = None) -> None:
+	"""
+	Sets the global parameters of the pipeline for a mode.
+	"""
+	global MODE, NORM_WAVELENGTHS, EXP_TYPE, LAYER_NAME, Y_UNIT
+
+	MODE = mode
+	# duplicates would give columns with the same long name
+	NORM_WAVELENGTHS = list(dict.fromkeys(norm_wavelengths)) if norm_wavelengths is not None else None
+	EXP_TYPE = exp_type
+	LAYER_NAME = BATCH_LAYER_NAME if mode is Mode.BATCH else NORMAL_LAYER_NAME
+	Y_UNIT = Y_BASE_UNIT if mode is Mode.BATCH or mode is Mode.TITRATION else Y_UNIT_NORMALIZED
+
+
+
+def configure_from_arguments(arguments : List[str], snapshot : ProjectSnapshot) -> None:
+	"""
+	Sets the mode from the arguments of the .ogs launchers, the batch mode is detected for each folder.
+	"""
+	if len(arguments) > 0 and arguments[-1] in INTERACTIVE_EXP_TYPES:
+		# master_sheets_interactive.ogs passes the wavelengths then the experiment type,
+		# an empty wavelengths field was dropped by run (like the options that are not set): parse_wavelengths rejects it
+		wavelengths = arguments[0] if len(arguments) == 2 else ''
+		exp_type = ExpType.EMISSION if arguments[-1] == 'Emission' else ExpType.EXCITATION
+		configure(Mode.INTERACTIVE, parse_wavelengths(wavelengths), exp_type)
+	elif len(arguments) == 1 and arguments[0] == 'titration':
+		configure(Mode.BATCH if detect_batch_mode(snapshot) else Mode.TITRATION)
+	else:
+		configure(Mode.AUTOMATIC)
+
+
+
+def print_summary(summary : List[Tuple[str, Mode, Dict[str, int]]]) -> None:
+	"""
+	summary: (folder path, mode, {master long name : number of new columns}) for every folder processed
+	"""
+	print('\n')
+	print('=' * 80)
+	print('summary: %d folders' % len(summary))
+	print('=' * 80)
+	for folder_path, mode, added in summary:
+		if len(added) == 0:
+			print('%-40s %-12s nothing to add' % (folder_path, mode.value))
+		for long_name, count in added.items():
+			print('%-40s %-12s %-30s %d new columns' % (folder_path, mode.value, long_name, count))
+
+
+
+def main(snapshot : ProjectSnapshot, backend : Backend) -> Dict[str, int]:
+	"""
+	Adds the worksheets of a folder to their masters, returns {master long name : number of new columns}
+	The backend is not closed, so that it can be shared by several folders.
+	"""
+	folder_name = snapshot.folder_name # folders do not have long names
 
 	parts = folder_name.split('_')
 	prefix = parts[0] # TN76_DCM_... -> TN76
@@ -302,52 +1152,120 @@ def main():
 
 
 	print('=' * 80)
-	print('current folder:\t' + folder.Path())
+	print('current folder:\t' + snapshot.folder_path)
 	print('=' * 80)
 	print('\n')
 
-	if folder.PageBases().GetCount() == 0:
+	if len(snapshot.folder_pages) == 0:
 		print('No worksheets found in the folder, nothing to do.')
-		return
+		return {}
 
-	worksheets = extract_folder(folder)
+	with profiling.phase('extract_folder'):
+		worksheets = extract_folder(snapshot, backend)
 
 	if (len(worksheets[ExpType.EMISSION]) == 0) and (len(worksheets[ExpType.EXCITATION]) == 0):
 		print('No suitable worksheets were found')
-		return
-
-	# moving to the project's root so that we can create sheets there
-	PyOrigin.XF('pe_cd', {'path' : '/'})
+		return {}
 
 	print('\n\n')
 
+	if MODE is Mode.TITRATION or MODE is Mode.BATCH:
+		# both experiment types go to the same STACK master: they are added in a single update,
+		# so that it stays in chronological order without rewriting the columns of the first type
+		shared = worksheets[ExpType.EMISSION] + worksheets[ExpType.EXCITATION]
+		if len(worksheets[ExpType.EMISSION]) > 0:
+			worksheets = {ExpType.EMISSION : shared, ExpType.EXCITATION : []}
+		else:
+			worksheets = {ExpType.EMISSION : [], ExpType.EXCITATION : shared}
+
+	added = {}
 	if MODE is not Mode.INTERACTIVE or EXP_TYPE is ExpType.EMISSION:
-		make_master_sheet(ExpType.EMISSION, prefix, worksheets)
+		with profiling.phase('make_master_sheet (Em)'):
+			added.update(make_master_sheet(ExpType.EMISSION, prefix, worksheets, backend))
 
 	print('\n\n')
 
 	if MODE is not Mode.INTERACTIVE or EXP_TYPE is ExpType.EXCITATION:
-		make_master_sheet(ExpType.EXCITATION, prefix, worksheets)
+		with profiling.phase('make_master_sheet (Ex)'):
+			added.update(make_master_sheet(ExpType.EXCITATION, prefix, worksheets, backend))
 
+	return added
 
 
-if __name__ == '__main__':
-	LAYER_NAME = NORMAL_LAYER_NAME
-	Y_UNIT = Y_UNIT_NORMALIZED
-
-	if len(sys.argv) == 3:
-		MODE = Mode.INTERACTIVE
-		NORM_WAVELENGTH = int(sys.argv[1])
-		EXP_TYPE = ExpType.EMISSION if sys.argv[2] == 'Emission' else ExpType.EXCITATION
-	elif len(sys.argv) == 2 and sys.argv[1] == 'titration':
-		if detect_batch_mode():
-			MODE = Mode.BATCH
-			LAYER_NAME = BATCH_LAYER_NAME
+
+def run(arguments : List[str], prepare : Optional[Callable[[List[ProjectSnapshot]], List[ProjectSnapshot]]] = None) -> None:
+	"""
+	Runs the script with the arguments of the .ogs launchers.
+	prepare can replace the snapshots before their worksheets are extracted (see rename_and_master.py).
+	"""
+	global EXPORT, PROCESSING
+
+	# the .ogs launchers pass empty strings for the options that are not set
+	arguments = [argument for argument in arguments if argument != '']
+
+	# --profile: prints the time spent in every phase and the PyOrigin calls
+	# --profile=trace.json: also saves the details (per-page timings...)
+	profile = next((argument for argument in arguments if argument.startswith(PROFILE_OPTION)), None)
+	if profile is not None:
+		arguments.remove(profile)
+		profiling.enable(PyOrigin)
+
+	# --project: every folder of the project (but the root, where the masters are) instead of the active one
+	project = PROJECT_OPTION in arguments
+	if project:
+		arguments.remove(PROJECT_OPTION)
+
+	# --export[=directory]: the new columns of the masters are also appended to their .npy export
+	export = next((argument for argument in arguments if argument.startswith(EXPORT_OPTION)), None)
+	if export is not None:
+		arguments.remove(export)
+		directory = export.partition('=')[2] or project_export_directory()
+		if directory is None:
+			print('the project was never saved, give the export directory: %s=C:\\path\\to\\directory' % EXPORT_OPTION)
 		else:
-			MODE = Mode.TITRATION
-		Y_UNIT = Y_BASE_UNIT
-	else:
-		MODE = Mode.AUTOMATIC
+			EXPORT = MasterExport(directory, X_START, X_END, X_STEP, SPECTRUM_DTYPE)
+
+	# --process[=chain]: the new columns of the masters are also processed into PROC_ masters
+	process = next((argument for argument in arguments if argument.startswith(PROCESS_OPTION)), None)
+	if process is not None:
+		arguments.remove(process)
+		PROCESSING = Processing(process.partition('=')[2] or DEFAULT_CHAIN, X_START, X_END, X_STEP, SPECTRUM_DTYPE)
+
+	try:
+		with profiling.phase('snapshot'):
+			if project:
+				snapshots = ProjectSnapshot.collect_all(walk_folders(PyOrigin.GetRootFolder()))
+			else:
+				snapshots = [ProjectSnapshot.collect(PyOrigin.ActiveFolder())]
+
+		if prepare is not None:
+			with profiling.phase('prepare'):
+				snapshots = prepare(snapshots)
+
+		# one backend for all the folders: the master index is loaded and saved once
+		backend = OriginBackend()
+		summary = []
+		with profiling.phase('main'):
+			for snapshot in snapshots:
+				try:
+					configure_from_arguments(arguments, snapshot)
+				except ValueError as error: # the arguments are the same for every folder: nothing was written yet
+					print('error: %s' % error)
+					return
+				print("working in mode: " + str(MODE))
+				summary.append((snapshot.folder_path, MODE, main(snapshot, backend)))
+			backend.close()
+
+		if project:
+			print_summary(summary)
+
+		if profile is not None:
+			profiling.report(profile.partition('=')[2])
+	finally:
+		(EXPORT, PROCESSING) = (None, None) # modules outlive the scripts in Origin
+		profiling.disable()
 
-	print("working in mode: " + str(MODE))
-	main()
\ No newline at end of file
+
+
+if __name__ == '__main__':
+	run(sys.argv[1:])
@@ -0,0 +1,120 @@
+import hashlib
+import json
+import os
+from typing import Dict, Optional, Tuple
+try:
+	import PyOrigin
+except ImportError: # headless.py (through master_export.py)
+	PyOrigin = None
+from note_parser import PARSER_VERSION, Correction, NoteRecord, parse_note
+
+# the cache is saved next to the project: MyProject.opju -> MyProject.notes.json
+CACHE_SUFFIX = '.notes.json'
+
+
+
+def note_hash(text : str) -> str:
+	return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+
+def project_file_path(suffix : str) -> Optional[str]:
+	"""
+	Path of a file next to the current project (MyProject.opju -> MyProject + suffix), None if the project was never saved.
+	"""
+	VAR_NAME = 'project_name'
+	# %X: directory of the project, %G: name of the project (without extension)
+	PyOrigin.LT_execute('string %s$="%%X|%%G";' % VAR_NAME)
+	(directory, name) = PyOrigin.LT_get_str(VAR_NAME).split('|')
+	if name == '':
+		return None
+	return os.path.join(directory, name + suffix)
+
+
+
+def project_cache_path() -> Optional[str]:
+	"""
+	Path of the cache file of the current project, None if the project was never saved.
+	"""
+	return project_file_path(CACHE_SUFFIX)
+
+
+
+def record_to_json(record : NoteRecord) -> dict:
+	fields = record._asdict()
+	fields['correction'] = {detector : list(correction) for detector, correction in record.correction.items()}
+	return fields
+
+
+
+def record_from_json(fields : dict) -> NoteRecord:
+	fields['correction'] = {detector : Correction(*correction) for detector, correction in fields['correction'].items()}
+	if fields['range'] is not None:
+		fields['range'] = tuple(fields['range'])
+	return NoteRecord(**fields)
+
+
+
+class NoteCache:
+	"""
+	Parsed Notes indexed by the hash of their text (a Note never changes after the acquisition),
+	and, for every page, the hash of the Note it was last renamed from with the long name it was given.
+	"""
+	def __init__(self, path : Optional[str]) -> None:
+		self.path = path
+		self.records : Dict[str, NoteRecord] = {}
+		self.renamed : Dict[str, Tuple[str, str]] = {}
+		self.modified = False
+
+		if path is None:
+			return
+		try:
+			with open(path) as f:
+				content = json.load(f)
+			# records parsed by another version of the parser are parsed again
+			if content.get('parser_version') == PARSER_VERSION:
+				self.records = {key : record_from_json(fields) for key, fields in content['records'].items()}
+			self.renamed = {name : tuple(entry) for name, entry in content['renamed'].items()}
+		except (FileNotFoundError, json.JSONDecodeError, KeyError, TypeError) as error:
+			if not isinstance(error, FileNotFoundError):
+				print('the Note cache %s is unreadable, it will be rebuilt' % path)
+
+	@classmethod
+	def for_project(cls) -> 'NoteCache':
+		return cls(project_cache_path())
+
+	def parse(self, text : str) -> Tuple[str, NoteRecord]:
+		"""
+		Returns the hash of the Note and its parsed content, the Note is only parsed if it was never seen.
+		"""
+		key = note_hash(text)
+		record = self.records.get(key)
+		if record is None:
+			record = parse_note(text)
+			self.records[key] = record
+			self.modified = True
+		return (key, record)
+
+	def is_renamed(self, short_name : str, key : str, long_name : str) -> bool:
+		"""
+		Whether the page was already given this long name from a Note with this hash.
+		"""
+		return self.renamed.get(short_name) == (key, long_name)
+
+	def set_renamed(self, short_name : str, key : str, long_name : str) -> None:
+		self.renamed[short_name] = (key, long_name)
+		self.modified = True
+
+	def save(self) -> None:
+		if self.path is None or not self.modified:
+			return
+
+		content = {
+			'parser_version' : PARSER_VERSION,
+			'records' : {key : record_to_json(record) for key, record in self.records.items()},
+			'renamed' : {name : list(entry) for name, entry in self.renamed.items()},
+		}
+		with open(self.path + '.tmp', mode = 'w') as f:
+			json.dump(content, f)
+		os.replace(self.path + '.tmp', self.path)
+		self.modified = False
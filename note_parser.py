@@ -0,0 +1,219 @@
+"""
+Single-pass parser for the Note sheet that FluorEssence attaches to every worksheet.
+
+The Note is a list of "Key: value" lines, followed by a [EXP_FILE] line and the experiment file
+(one line of XML). It follows the same rules as extract_parameters() in rename_files.c:
+
+* the lines are told apart by their prefix, ignoring the case (is_str_match_begin)
+* the value is then read with the sscanf format of the prefix (VALUE_PATTERNS), which is case sensitive:
+  "integration time: 0.1s" is recognized but gives no value, the type has to be "Spectral Acquisition[...]"
+* "EX1: Excitation" and "EM1: Emission" tell which monochromator the following
+  "Side Entrance Slit:" line belongs to
+* when a parameter appears several times, the last value that could be read wins
+* the lines after the experiment file are read too
+
+Only the <Correction> element and the <Axis> of the experiment file are read, the rest of the XML is skipped.
+"""
+
+import re
+from collections import Counter, namedtuple
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+from xml.sax.saxutils import unescape
+
+EXP_FILE_MARKER = '[EXP_FILE]'
+# changes when parse_note reads the same Note differently (the records cached by note_cache.py are dropped)
+PARSER_VERSION = 2
+
+# what %f reads (leading white space skipped)
+FLOAT = '\\s*([-+]?(?:\\d+\\.?\\d*|\\.\\d+)(?:[eE][-+]?\\d+)?)'
+ATTRIBUTE_PATTERN = re.compile('([\\w:]+)="([^"]*)"')
+CORRECTION_ELEMENT_PATTERN = re.compile('<(SCD\\d+)\\s([^>]*?)/?>')
+# [Ex_]folder_park_exslit_emslit_time[-n...][__(wavelength)], see build_long_name
+LONG_NAME_PATTERN = re.compile('(Ex_)?.*_(\\d+)_(\\d+(?:\\.\\d)?)_(\\d+(?:\\.\\d)?)_\\d+(?:\\.\\d)?(?:-\\d+)*(?:__\\(\\d+\\))?$')
+
+# (lowercase prefix, key)
+LINE_PREFIXES = (
+	('experiment type:',    'experiment_type'),
+	('integration time:',   'integration_time'),
+	('park:',               'park'),
+	('ex1: excitation',     'excitation'),
+	('em1: emission',       'emission'),
+	('side entrance slit:', 'slit'),
+)
+
+# the sscanf formats of rename_files.c (a space matches any white space, %63[^]] up to 63 characters but ']')
+VALUE_PATTERNS = {
+	'experiment_type'  : re.compile('Experiment\\s*Type:\\s*Spectral\\s*Acquisition\\[([^\\]]{1,63})'),
+	'integration_time' : re.compile('Integration\\s*Time:' + FLOAT),
+	'park'             : re.compile('Park:' + FLOAT),
+	'slit'             : re.compile('Side\\s*Entrance\\s*Slit:' + FLOAT),
+}
+
+# in the order rename_files.c checks them
+REQUIRED_PARAMETERS = ('experiment_type', 'integration_time', 'excitation_slit', 'emission_slit', 'park')
+
+Correction = namedtuple('Correction', [
+	'dark',       # darkEnabled
+	'blank',      # blankEnabled
+	'blank_file', # blankFile
+	'correction', # correctionEnabled
+])
+
+
+
+class NoteRecord(namedtuple('NoteRecord', [
+	'experiment_type',  # 'Emission' or 'Excitation'
+	'park',
+	'excitation_slit',
+	'emission_slit',
+	'integration_time',
+	'correction',       # detector name ('SCD1', 'SCD2') -> Correction
+	'range',            # (begin, end) of the experiment axis, in nm
+])):
+	__slots__ = ()
+
+	def check(self) -> 'NoteRecord':
+		"""
+		Raises a KeyError if one of the parameters needed to rename the page is missing.
+		"""
+		for key in REQUIRED_PARAMETERS:
+			if getattr(self, key) is None:
+				raise KeyError('could not find the following experimental parameter: ' + key)
+		return self
+
+
+
+def read_attributes(string : str) -> Dict[str, str]:
+	return {key : unescape(value, {'&quot;' : '"', '&apos;' : "'"}) for key, value in ATTRIBUTE_PATTERN.findall(string)}
+
+
+
+def parse_correction(xml : str) -> Dict[str, Correction]:
+	"""
+	Reads the SCDn children of the <Correction> element, stops at its closing tag.
+	"""
+	start = xml.find('<Correction')
+	if start == -1:
+		return {}
+	end = xml.find('</Correction>', start)
+	if end == -1:
+		end = len(xml)
+
+	correction = {}
+	for match in CORRECTION_ELEMENT_PATTERN.finditer(xml, start, end):
+		attributes = read_attributes(match.group(2))
+		correction[match.group(1)] = Correction(
+			dark       = attributes.get('darkEnabled'),
+			blank      = attributes.get('blankEnabled'),
+			blank_file = attributes.get('blankFile'),
+			correction = attributes.get('correctionEnabled'),
+		)
+	return correction
+
+
+
+def parse_range(xml : str) -> Optional[Tuple[float, float]]:
+	start = xml.find('<Axis ')
+	if start == -1:
+		return None
+	end = xml.find('>', start)
+	attributes = read_attributes(xml[start:end])
+	try:
+		return (float(attributes['Begin']), float(attributes['End']))
+	except (KeyError, ValueError):
+		return None
+
+
+
+def parse_note(text : str) -> NoteRecord:
+	"""
+	Parses the text of a Note in a single pass over its lines.
+	Missing parameters are None, see NoteRecord.check()
+	"""
+	parameters = dict.fromkeys(NoteRecord._fields)
+	parameters['correction'] = {}
+	slit_key = None
+
+	lines = iter(text.splitlines())
+	for line in lines:
+		if line.startswith(EXP_FILE_MARKER):
+			xml = next(lines, '')
+			parameters['correction'] = parse_correction(xml)
+			parameters['range'] = parse_range(xml)
+			continue
+
+		lowered = line[:len('side entrance slit:')].lower()
+		for prefix, key in LINE_PREFIXES:
+			if lowered.startswith(prefix):
+				break
+		else:
+			continue
+
+		if key == 'excitation' or key == 'emission':
+			slit_key = key + '_slit'
+			continue
+
+		match = VALUE_PATTERNS[key].match(line)
+		if match is None:
+			continue
+		if key == 'experiment_type':
+		# "Experiment Type: Spectral Acquisition[Emission]"
+			parameters[key] = match.group(1)
+		elif key == 'slit':
+			if slit_key is not None:
+				parameters[slit_key] = float(match.group(1))
+		else:
+			parameters[key] = float(match.group(1))
+
+	return NoteRecord(**parameters)
+
+
+
+def format_parameter(value : float) -> str:
+	# if there are no decimals, we do not want the .0, else we want 1 decimal (like rename_files.c)
+	return '%.*f' % (0 if abs(value % 1) < 1e-9 else 1, value)
+
+
+
+def build_long_name(folder_name : str, parameters : NoteRecord) -> str:
+	return '%s%s_%.0f_%s_%s_%s' % (
+		'' if parameters.experiment_type == 'Emission' else 'Ex_',
+		folder_name,
+		parameters.park,
+		format_parameter(parameters.excitation_slit),
+		format_parameter(parameters.emission_slit),
+		format_parameter(parameters.integration_time),
+	)
+
+
+
+def parse_long_name(long_name : str) -> Optional[Tuple[str, float, float, float]]:
+	"""
+	(experiment type, park, excitation slit, emission slit) of a long name made by build_long_name,
+	possibly followed by the suffixes of the masters (-n for duplicates and BATCH columns, __(wavelength) in INTERACTIVE mode).
+	None if the long name was not built from a Note.
+	"""
+	match = LONG_NAME_PATTERN.match(long_name)
+	if match is None:
+		return None
+	experiment_type = 'Emission' if match.group(1) is None else 'Excitation'
+	return (experiment_type, float(match.group(2)), float(match.group(3)), float(match.group(4)))
+
+
+
+def add_duplicate_suffixes(pages : List[Tuple[datetime, str]]) -> List[str]:
+	"""
+	Pages (creation date, long name) sharing a long name get a -n suffix, like in rename_files.c:
+	the newest gets the highest n, the oldest keeps the plain name (the pages without a date count as the newest).
+	"""
+	counts = Counter(name for _, name in pages)
+	names = [None] * len(pages)
+
+	for i in sorted(range(len(pages)), key = lambda i : (pages[i][0] is None, pages[i][0] or datetime.min), reverse = True):
+		name = pages[i][1]
+		count = counts[name]
+		names[i] = name if count == 1 else '%s-%d' % (name, count - 1)
+		counts[name] -= 1
+
+	return names
@@ -0,0 +1,160 @@
+"""
+Reads the bundles of presets written by fluor_essence_xml.py --bundle: a single zip file holding every preset
+at its path in the Presets tree, and an index of the presets by parameters.
+A preset is read from the bundle without unpacking it.
+
+usage:
+    python preset_bundle.py Presets.zip lookup Emission 300 2 1 0.1              (prints the XML)
+    python preset_bundle.py Presets.zip lookup Excitation 355 1 2 0.5 --nearest  (or that of the nearest park)
+    python preset_bundle.py Presets.zip lookup Emission 300 2 1 0.1 -o preset.xml
+    python preset_bundle.py Presets.zip extract --slits 2-1 --time 0.1           (into Presets/2-1/0.1/)
+    python preset_bundle.py Presets.zip list
+"""
+
+import argparse
+import json
+import sys
+import zipfile
+from collections import namedtuple
+from fluor_essence_xml import BUNDLE_INDEX_NAME, BUNDLE_VERSION, ROOT_DIR_NAME, ExperimentType, preset_key
+
+BundleEntry = namedtuple('BundleEntry', ['exp_type', 'park', 'ex_slit', 'em_slit', 'integration_time', 'name', 'range'])
+
+
+class PresetBundle:
+
+    def __init__(self, path : str):
+        self.zip = zipfile.ZipFile(path)
+        index = json.loads(self.zip.read(BUNDLE_INDEX_NAME))
+        if index.get('version') != BUNDLE_VERSION:
+            raise ValueError(f"{path} is a bundle of version {index.get('version')}, version {BUNDLE_VERSION} was expected")
+
+        self.entries : dict[str, BundleEntry] = {}
+        # (exp type, ex slit, em slit, integration time) -> parks, for the nearest park
+        self.parks : dict[tuple, list[int]] = {}
+        for key, (name, start_wavelength, end_wavelength) in index['presets'].items():
+            (exp_type, park, ex_slit, em_slit, integration_time) = key.split('|')
+            entry = BundleEntry(exp_type, int(park), ex_slit, em_slit, integration_time, name, (start_wavelength, end_wavelength))
+            self.entries[key] = entry
+            self.parks.setdefault((exp_type, ex_slit, em_slit, integration_time), []).append(entry.park)
+
+    def close(self) -> None:
+        self.zip.close()
+
+    def __enter__(self) -> 'PresetBundle':
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.close()
+
+    def find(self, exp_type : ExperimentType, park, ex_slit, em_slit, integration_time, nearest : bool = False) -> BundleEntry:
+        """
+        The preset with these parameters, or with the nearest park if nearest (and the others match),
+        raises a KeyError if there is none.
+        """
+        key = preset_key(exp_type.value, park, ex_slit, em_slit, integration_time)
+        if key in self.entries or not nearest:
+            return self.entries[key]
+
+        (_, _, ex_slit, em_slit, integration_time) = key.split('|')
+        parks = self.parks[(exp_type.value, ex_slit, em_slit, integration_time)]
+        park = min(parks, key = lambda candidate : (abs(candidate - park), candidate))
+        return self.entries[preset_key(exp_type.value, park, ex_slit, em_slit, integration_time)]
+
+    def read(self, entry : BundleEntry) -> str:
+        return self.zip.read(entry.name).decode()
+
+    def lookup(self, exp_type : ExperimentType, park, ex_slit, em_slit, integration_time, nearest : bool = False) -> str:
+        """
+        The XML of the preset with these parameters (see find).
+        """
+        return self.read(self.find(exp_type, park, ex_slit, em_slit, integration_time, nearest))
+
+    def select(self, *, exp_type : ExperimentType | None = None, slits : str | None = None,
+               integration_time : float | None = None, parks : list[int] | None = None) -> list[BundleEntry]:
+        """
+        The presets matching the given parameters, slits is the name of their directory (e.g. '2-1').
+        """
+        selected = []
+        for entry in self.entries.values():
+            if exp_type is not None and entry.exp_type != exp_type.value:
+                continue
+            if slits is not None and entry.name.split('/')[0] != slits:
+                continue
+            if integration_time is not None and float(entry.integration_time) != integration_time:
+                continue
+            if parks is not None and entry.park not in parks:
+                continue
+            selected.append(entry)
+        return selected
+
+    def extract(self, entries : list[BundleEntry], directory : str = ROOT_DIR_NAME) -> None:
+        """
+        Writes the presets into directory, at their path in the Presets tree.
+        """
+        for entry in entries:
+            self.zip.extract(entry.name, directory)
+
+
+def parse_arguments() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description = 'Reads the presets of a bundle written by fluor_essence_xml.py --bundle.')
+    parser.add_argument('bundle', help = 'zip file written by fluor_essence_xml.py --bundle')
+    commands = parser.add_subparsers(dest = 'command', required = True)
+
+    lookup = commands.add_parser('lookup', help = 'prints the XML of a preset')
+    lookup.add_argument('exp_type', choices = [exp_type.value for exp_type in ExperimentType])
+    lookup.add_argument('park', type = int)
+    lookup.add_argument('ex_slit', type = float)
+    lookup.add_argument('em_slit', type = float)
+    lookup.add_argument('integration_time', type = float)
+    lookup.add_argument('--nearest', action = 'store_true', help = 'take the nearest park if there is no preset at this one')
+    lookup.add_argument('-o', '--output', metavar = 'FILE', help = 'write the XML to a file instead')
+
+    extract = commands.add_parser('extract', help = f"writes the selected presets into the {ROOT_DIR_NAME} tree")
+    extract.add_argument('--exp-type', choices = [exp_type.value for exp_type in ExperimentType])
+    extract.add_argument('--slits', help = "directory of the slits, e.g. '2-1'")
+    extract.add_argument('--time', type = float, help = 'integration time')
+    extract.add_argument('--park', type = int, nargs = '+')
+    extract.add_argument('-C', '--directory', default = ROOT_DIR_NAME, help = f"(default: {ROOT_DIR_NAME})")
+
+    commands.add_parser('list', help = 'prints the presets of the bundle')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+
+    with PresetBundle(args.bundle) as bundle:
+        match args.command:
+            case 'lookup':
+                exp_type = ExperimentType(args.exp_type)
+                try:
+                    entry = bundle.find(exp_type, args.park, args.ex_slit, args.em_slit, args.integration_time, args.nearest)
+                except KeyError:
+                    sys.exit(f"no {exp_type.value} preset with slits {args.ex_slit:g}-{args.em_slit:g} "
+                             f"and integration time {args.integration_time:g}" + ('' if args.nearest else f" at {args.park} nm"))
+                if entry.park != args.park:
+                    print(f"nearest park: {entry.park} nm", file = sys.stderr)
+
+                xml_string = bundle.read(entry)
+                if args.output:
+                    with open(args.output, mode = 'w') as f:
+                        f.write(xml_string)
+                    print(f"{entry.name} has range {entry.range} nm, written to {args.output}", file = sys.stderr)
+                else:
+                    print(xml_string)
+
+            case 'extract':
+                exp_type = ExperimentType(args.exp_type) if args.exp_type else None
+                entries = bundle.select(exp_type = exp_type, slits = args.slits, integration_time = args.time, parks = args.park)
+                bundle.extract(entries, args.directory)
+                print(f"{len(entries)} presets extracted into {args.directory}")
+
+            case 'list':
+                for entry in bundle.entries.values():
+                    print(f"{entry.name} has range {entry.range} nm")
+                print(f"{len(bundle.entries)} presets")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,157 @@
+"""
+Processing of the columns of the masters (see master_sheets.py --process), written to a sibling master
+(PROC_NORM_TN76_Em next to NORM_TN76_Em).
+
+The columns are put on the wavelength grid of the masters as a 2D array (one row per spectrum)
+and every step of the chain works on the whole array at once:
+
+	mask[:width]       masks the Rayleigh scattering of the lamp (first and second order), from the park and the slits
+	                   of each column (parsed from its long name, see note_parser.parse_long_name); the band around
+	                   k * park is as wide as the slit of the monochromator at the park (scaled by k)
+	                   plus that of the scanning one, times width (default: 2)
+	baseline[:percent] subtracts a constant baseline, the given percentile of each spectrum (default: 5)
+	smooth[:points]    moving average over an odd number of points (default: 5), the masked points are left out
+
+A chain is written like "mask,baseline,smooth:9", the steps run in that order.
+Masked points are NaN (missing values in Origin).
+"""
+
+import copy
+from typing import List, Tuple
+import numpy as np
+from master_export import to_grid
+from note_parser import parse_long_name
+
+DEFAULT_CHAIN = 'mask,baseline,smooth'
+
+# (order of the Rayleigh scattering, position of the band as a multiple of the park) by experiment type:
+# in Emission the detector scans and sees the lamp at the park and its 2n reflection,
+# in Excitation the lamp scans and the detector, parked, sees it at the park and at half of it
+RAYLEIGH_BANDS = {
+	'Emission'   : (1, 2),
+	'Excitation' : (1, 0.5),
+}
+
+DEFAULT_PARAMETERS = {
+	'mask'     : 2.0,
+	'baseline' : 5.0,
+	'smooth'   : 5,
+}
+
+
+
+def mask_rayleigh(matrix : np.ndarray, wavelengths : np.ndarray, long_names : List[str], width : float) -> np.ndarray:
+	"""
+	Sets the Rayleigh scattering bands of the spectra to NaN, the spectra whose long name cannot be parsed are kept as they are.
+	"""
+	# (spectrum, band): center and half width, NaN when unknown (no band is masked)
+	centers = np.full((len(long_names), 2), np.nan)
+	half_widths = np.full((len(long_names), 2), np.nan)
+
+	for i, long_name in enumerate(long_names):
+		parameters = parse_long_name(long_name)
+		if parameters is None:
+			print('warning: no park and slits in the long name %s, its Rayleigh scattering is not masked' % long_name)
+			continue
+		(experiment_type, park, ex_slit, em_slit) = parameters
+		(park_slit, scan_slit) = (ex_slit, em_slit) if experiment_type == 'Emission' else (em_slit, ex_slit)
+		k = np.asarray(RAYLEIGH_BANDS[experiment_type])
+		centers[i] = k * park
+		half_widths[i] = width * (k * park_slit + scan_slit) / 2
+
+	masked = (np.abs(wavelengths[np.newaxis, np.newaxis, :] - centers[:, :, np.newaxis]) <= half_widths[:, :, np.newaxis]).any(axis = 1)
+	matrix[masked] = np.nan
+	return matrix
+
+
+
+def subtract_baseline(matrix : np.ndarray, percentile : float) -> np.ndarray:
+	empty = np.isnan(matrix).all(axis = 1)
+	baselines = np.zeros(len(matrix))
+	if not empty.all():
+		baselines[~empty] = np.nanpercentile(matrix[~empty], percentile, axis = 1)
+	matrix -= baselines[:, np.newaxis]
+	return matrix
+
+
+
+def smooth(matrix : np.ndarray, points : int) -> np.ndarray:
+	"""
+	Moving average of the spectra, NaN points are left out of the averages and stay NaN.
+	"""
+	half = int(points) // 2
+	if half == 0:
+		return matrix
+
+	missing = np.isnan(matrix)
+	values = np.where(missing, 0.0, matrix)
+	counts = (~missing).astype(float)
+
+	# sums over the windows from cumulative sums (padded so that the windows are clipped at the edges)
+	def window_sums(array : np.ndarray) -> np.ndarray:
+		cumulative = np.zeros((array.shape[0], array.shape[1] + 2 * half + 1))
+		cumulative[:, half + 1 : half + 1 + array.shape[1]] = np.cumsum(array, axis = 1)
+		cumulative[:, half + 1 + array.shape[1]:] = cumulative[:, half + array.shape[1], np.newaxis]
+		return cumulative[:, 2 * half + 1:] - cumulative[:, :-2 * half - 1]
+
+	with np.errstate(invalid = 'ignore', divide = 'ignore'):
+		smoothed = window_sums(values) / window_sums(counts)
+	smoothed[missing] = np.nan
+	return smoothed
+
+
+
+def parse_chain(string : str) -> List[Tuple[str, float]]:
+	"""
+	"mask:1.5,smooth:9" -> [('mask', 1.5), ('smooth', 9.0)], the steps without a parameter get their default one
+	(DEFAULT_PARAMETERS), raises a ValueError for unknown steps.
+	"""
+	chain = []
+	for step in string.split(','):
+		(name, _, parameter) = step.strip().partition(':')
+		if name not in DEFAULT_PARAMETERS:
+			raise ValueError('unknown processing step %s (%s)' % (name, ', '.join(DEFAULT_PARAMETERS)))
+		chain.append((name, float(parameter) if parameter != '' else DEFAULT_PARAMETERS[name]))
+	return chain
+
+
+
+class Processing:
+	"""
+	A chain of processing steps applied to the columns of the masters on the x_start..x_end grid (every x_step).
+	"""
+	def __init__(self, chain : str, x_start : float, x_end : float, x_step : float = 1, dtype = np.float64) -> None:
+		self.chain = parse_chain(chain)
+		self.x_start = x_start
+		self.x_end = x_end
+		self.x_step = x_step
+		self.dtype = dtype
+
+	def apply(self, columns : list) -> list:
+		"""
+		Processed copies of the columns (master_sheets.Column).
+		"""
+		if len(columns) == 0:
+			return []
+
+		matrix = to_grid(columns, self.x_start, self.x_end, self.x_step, self.dtype)
+		wavelengths = self.x_start + self.x_step * np.arange(matrix.shape[1])
+		for name, parameter in self.chain:
+			if name == 'mask':
+				matrix = mask_rayleigh(matrix, wavelengths, [column.long_name for column in columns], parameter)
+			elif name == 'baseline':
+				matrix = subtract_baseline(matrix, parameter)
+			elif name == 'smooth':
+				matrix = smooth(matrix, parameter)
+
+		processed = []
+		for column, row in zip(columns, matrix):
+			# the range of the original column (a mask at its ends trims it)
+			filled = np.flatnonzero(~np.isnan(row))
+			(first, last) = (filled[0], filled[-1] + 1) if len(filled) > 0 else (0, 0)
+			column = copy.copy(column)
+			column.values = row[first:last]
+			column.x_start = self.x_start + int(first) * self.x_step
+			column.x_end = column.x_start + (len(column.values) - 1) * self.x_step
+			processed.append(column)
+		return processed
@@ -0,0 +1,217 @@
+"""
+Optional instrumentation of master_sheets.py: time spent in every phase of a run, and round trips to PyOrigin.
+
+	with profiling.phase('read_columns', page = name):
+		...
+
+does nothing until enable() is called (phase() then returns a shared no-op context manager).
+Once enabled, phases are timed (nested phases are reported under their parent), and every PyOrigin
+function and method is wrapped to count its calls, their duration and the data they move,
+attributed to the phase they happen in. report() prints the summary table and can save a JSON trace,
+disable() puts the original PyOrigin functions back.
+"""
+
+import json
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+# PyOrigin classes whose methods are counted
+PYORIGIN_CLASSES = ('CPyOriginCollectionBase', 'CPyColumn', 'CPyWorksheet', 'CPyWorksheetPage', 'CPyPageBase', 'CPyFolder')
+
+PROFILER : Optional['Profiler'] = None
+
+
+
+class NullPhase:
+	def __enter__(self) -> None:
+		pass
+
+	def __exit__(self, *_) -> None:
+		pass
+
+NULL_PHASE = NullPhase()
+
+
+
+def phase(name : str, page : Optional[str] = None):
+	"""
+	Times the enclosed block as a phase, page names the worksheet it works on (for the per-page trace).
+	"""
+	if PROFILER is None:
+		return NULL_PHASE
+	return PROFILER.phase(name, page)
+
+
+
+def payload_size(value) -> int:
+	"""
+	Approximate size in bytes of the data passed to or returned by PyOrigin.
+	"""
+	if isinstance(value, str):
+		return len(value)
+	if isinstance(value, (int, float)):
+		return 8
+	if isinstance(value, (list, tuple)):
+		return sum(payload_size(item) for item in value)
+	return getattr(value, 'nbytes', 0) # numpy arrays
+
+
+
+class PhaseStats:
+	def __init__(self) -> None:
+		self.count = 0
+		self.seconds = 0.0
+		self.calls = 0
+		self.bytes = 0
+
+
+
+class Phase:
+	def __init__(self, profiler : 'Profiler', name : str, page : Optional[str]) -> None:
+		self.profiler = profiler
+		self.name = name
+		self.page = page
+
+	def __enter__(self) -> None:
+		self.profiler.stack.append(self.name)
+		self.path = '/'.join(self.profiler.stack)
+		self.stats = self.profiler.phases[self.path] # registered on entry, so that parents are listed before their children
+		self.start = time.perf_counter()
+
+	def __exit__(self, *_) -> None:
+		seconds = time.perf_counter() - self.start
+		self.profiler.stack.pop()
+		self.stats.count += 1
+		self.stats.seconds += seconds
+		if self.page is not None:
+			self.profiler.pages.append({'phase' : self.path, 'page' : self.page, 'seconds' : seconds})
+
+
+
+class Profiler:
+	def __init__(self) -> None:
+		self.start = time.perf_counter()
+		self.stack : List[str] = []
+		self.phases : Dict[str, PhaseStats] = defaultdict(PhaseStats) # 'main/make_master_sheet' -> stats ('' outside phases)
+		self.calls : Dict[str, PhaseStats] = defaultdict(PhaseStats)  # 'CPyColumn.GetData' -> stats
+		self.pages : List[dict] = []
+		self.originals = [] # (owner, attribute name, original function)
+
+	def phase(self, name : str, page : Optional[str]) -> Phase:
+		return Phase(self, name, page)
+
+	def record_call(self, api : str, seconds : float, size : int) -> None:
+		stats = self.calls[api]
+		stats.calls += 1
+		stats.seconds += seconds
+		stats.bytes += size
+
+		# the calls of a phase include those of its children, like its time
+		paths = ['/'.join(self.stack[:depth]) for depth in range(1, len(self.stack) + 1)] or ['']
+		for path in paths:
+			stats = self.phases[path]
+			stats.calls += 1
+			stats.bytes += size
+
+	def wrap(self, owner, attribute : str, api : str) -> None:
+		function = getattr(owner, attribute)
+		profiler = self
+
+		def wrapper(*args, **kwargs):
+			start = time.perf_counter()
+			result = function(*args, **kwargs)
+			seconds = time.perf_counter() - start
+			profiler.record_call(api, seconds, payload_size(args) + payload_size(result))
+			return result
+
+		try:
+			setattr(owner, attribute, wrapper)
+		except (AttributeError, TypeError): # read-only builtin
+			return
+		self.originals.append((owner, attribute, function))
+
+	def instrument(self, module) -> None:
+		"""
+		Wraps the public functions of the PyOrigin module and the methods of its classes.
+		"""
+		for attribute in dir(module):
+			value = getattr(module, attribute)
+			if attribute[0].isupper() and callable(value) and not isinstance(value, type):
+				self.wrap(module, attribute, attribute)
+
+		classes = {getattr(module, name) for name in PYORIGIN_CLASSES if hasattr(module, name)}
+		for cls in classes:
+			for attribute, value in list(vars(cls).items()):
+				if attribute[0].isupper() and callable(value):
+					self.wrap(cls, attribute, '%s.%s' % (cls.__name__, attribute))
+
+	def restore(self) -> None:
+		for owner, attribute, function in reversed(self.originals):
+			setattr(owner, attribute, function)
+		self.originals = []
+
+	def summary(self) -> str:
+		total = time.perf_counter() - self.start
+		lines = ['%-46s %6s %9s %6s %7s %10s' % ('phase', 'count', 'time (s)', '%', 'calls', 'bytes')]
+		lines.append('-' * len(lines[0]))
+		for path, stats in self.phases.items():
+			depth = path.count('/')
+			name = '  ' * depth + (path.rsplit('/', 1)[-1] or '(outside phases)')
+			lines.append('%-46s %6d %9.3f %6.1f %7d %10d' %
+				(name, stats.count, stats.seconds, 100 * stats.seconds / total, stats.calls, stats.bytes))
+
+		lines.append('')
+		lines.append('%-46s %6s %9s %6s %7s %10s' % ('PyOrigin', '', 'time (s)', '%', 'calls', 'bytes'))
+		lines.append('-' * len(lines[0]))
+		for api, stats in sorted(self.calls.items(), key = lambda item : item[1].seconds, reverse = True):
+			lines.append('%-46s %6s %9.3f %6.1f %7d %10d' %
+				(api, '', stats.seconds, 100 * stats.seconds / total, stats.calls, stats.bytes))
+
+		lines.append('')
+		lines.append('total: %.3f s' % total)
+		return '\n'.join(lines)
+
+	def trace(self) -> dict:
+		def to_dict(stats : PhaseStats) -> dict:
+			return {'count' : stats.count, 'seconds' : stats.seconds, 'calls' : stats.calls, 'bytes' : stats.bytes}
+
+		return {
+			'seconds' : time.perf_counter() - self.start,
+			'phases'  : {path : to_dict(stats) for path, stats in self.phases.items()},
+			'calls'   : {api : to_dict(stats) for api, stats in self.calls.items()},
+			'pages'   : self.pages,
+		}
+
+
+
+def enable(module) -> Profiler:
+	"""
+	Starts profiling, module is PyOrigin (or a stand-in such as fake_pyorigin).
+	"""
+	global PROFILER
+	if PROFILER is not None: # left by a run that failed, modules outlive the scripts in Origin
+		disable()
+	PROFILER = Profiler()
+	PROFILER.instrument(module)
+	return PROFILER
+
+
+
+def disable() -> None:
+	global PROFILER
+	if PROFILER is not None:
+		PROFILER.restore()
+	PROFILER = None
+
+
+
+def report(trace_path : Optional[str] = None) -> None:
+	if PROFILER is None:
+		return
+
+	print('\n' + PROFILER.summary())
+	if trace_path:
+		with open(trace_path, mode = 'w') as f:
+			json.dump(PROFILER.trace(), f, indent = '\t')
+		print('trace saved to ' + trace_path)
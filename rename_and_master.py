@@ -0,0 +1,46 @@
+"""
+Renames the worksheets from their Note (like renaming.py) and adds them to their master sheets (like master_sheets.py)
+in a single run, with the same arguments as master_sheets.py.
+
+Every Note is read and parsed once: the parsed experiment type sorts the worksheets into the Em and Ex masters
+(instead of looking for 'Ex' in their names), and the creation dates fetched for the snapshot are used
+both for the -n suffixes of the long names and for the order of the columns.
+"""
+
+import sys
+from typing import List
+import master_sheets
+from master_sheets import ExpType, ProjectSnapshot, is_valid_page
+from note_cache import NoteCache
+from renaming import rename_pages
+
+
+
+def rename_snapshots(snapshots : List[ProjectSnapshot]) -> List[ProjectSnapshot]:
+	"""
+	Renames the worksheets of the snapshots, returns the snapshots with the new long names
+	and the experiment types of the Notes.
+	"""
+	cache = NoteCache.for_project()
+	renamed_snapshots = []
+
+	for snapshot in snapshots:
+		print('\n\ncurrent folder: ' + snapshot.folder_path + '\n\n')
+		pages = [page for page in snapshot.folder_pages if is_valid_page(page)]
+		(names, _) = rename_pages(snapshot.folder_name, pages, cache)
+
+		folder_pages = []
+		for page in snapshot.folder_pages:
+			if page.name in names:
+				(long_name, record) = names[page.name]
+				page = page._replace(long_name = long_name, exp_type = ExpType.from_note(record.experiment_type))
+			folder_pages.append(page)
+		renamed_snapshots.append(ProjectSnapshot(snapshot.folder_name, snapshot.folder_path, folder_pages))
+
+	cache.save()
+	return renamed_snapshots
+
+
+
+if __name__ == '__main__':
+	master_sheets.run(sys.argv[1:], prepare = rename_snapshots)
@@ -144,6 +144,31 @@ string get_creation_date (string short_name)
 
 
 
+// creation dates of every worksheet in the folders (graphs and matrices are left out), the paths are separated by '|'
+// format: "Book1,14/06/2023 07:44;Book2,14/06/2023 07:46;"
+string get_creation_dates (string folder_paths)
+{
+	vector<string> paths;
+	int nb_paths = str_separate(folder_paths, "|", paths);
+
+	string records;
+	for (int i = 0; i < nb_paths; i++) {
+		Folder folder = Project.GetFolderWithPath(paths[i]);
+		if (!folder.IsValid())
+			continue;
+
+		foreach (PageBase pagebase in folder.Pages) {
+			if (pagebase.GetType() != EXIST_WKS)
+				continue;
+			string name = pagebase.GetName();
+			records += name + "," + get_creation_date(name) + ";";
+		}
+	}
+	return records;
+}
+
+
+
 static time_t datestring_to_epoch_time (string datestring)
 {
 	int day, month, year, hours, minutes;
@@ -195,13 +220,12 @@ static void sort_array (Array<PageStruct&> &array)
 
 
 
-void rename_files (void)
+// renames the worksheets of the folder, returns the number of worksheets renamed
+static int rename_folder (Folder &folder)
 {
-	Folder folder = Project.ActiveFolder();
-
 	printf("\n\n"
 		"=================================================""\n"
-		"active folder:\t%s"                               "\n"
+		"folder:\t%s"                                      "\n"
 		"=================================================""\n",
 		folder.GetPath()
 	);
@@ -261,6 +285,7 @@ void rename_files (void)
 	vector<uint> counts;
 	count_list(names, unique_names, counts);
 
+	int nb_renamed = 0;
 	for (int i = 0; i < pagesArray.GetSize(); i++) {
 		PageStruct& page_struct = pagesArray.GetAt(i);
 		string name = page_struct.name;
@@ -277,8 +302,49 @@ void rename_files (void)
 		printf("renaming: created %s, old name = %s, new name = %s\n", info.szCreate, page.GetLongName(), name);
 		if (!page.SetLongName(name, false, true))
 			printf("unable to rename page %s (%s)", page.GetName(), page.GetLongName());
+		else
+			nb_renamed++;
 		counts[idx]--;
 	}
+	return nb_renamed;
+}
+
+
+
+void rename_files (void)
+{
+	Folder folder = Project.ActiveFolder();
+	rename_folder(folder);
+}
+
+
+
+static void rename_subfolders (Folder &folder, vector<string> &summary)
+{
+	foreach (Folder subfolder in folder.Subfolders) {
+		int nb_renamed = rename_folder(subfolder);
+
+		string line;
+		line.Format("%-40s %d worksheets renamed", subfolder.GetPath(), nb_renamed);
+		summary.Add(line);
+
+		rename_subfolders(subfolder, summary);
+	}
+}
+
+
+
+// same as rename_files, for every folder of the project
+// (but the root folder, which holds the master sheets)
+void rename_project_files (void)
+{
+	Folder root = Project.RootFolder;
+	vector<string> summary;
+	rename_subfolders(root, summary);
+
+	printf("\n\nsummary: %d folders\n", summary.GetSize());
+	for (int i = 0; i < summary.GetSize(); i++)
+		printf("%s\n", summary[i]);
 }
 
 
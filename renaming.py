@@ -1,74 +1,92 @@
+import sys
+from typing import Dict, List, Optional, Tuple
+from datetime import datetime
 import PyOrigin
-import re
-from typing import Dict
-from collections import namedtuple
-
-Parameters = namedtuple('Parameters', [
-	'experiment_type',
-	'park',
-	'integration_time',
-	'excitation_slit',
-	'emission_slit',
-])
-
-FLOAT_PATTERN = '(\\d+(?:\\.\\d+)?)'
-SLIT_PATTERN = '.*\n(?:.+\n)*Side Entrance Slit: %s nmBandpass' % FLOAT_PATTERN
-
-def get_parameter(pattern : str, key : str, string: str, parameters : Dict):
-	match = re.search(pattern = pattern, string = string)
-	if match:
-		parameters[key] = match.groups()[0]
-	else:
-		raise KeyError('could not find the following experimental parameter: ' + key)
-
-
-def parse_experiment(text : str) -> Parameters:
-	text = text.replace('\r\n', '\n')
-
-	PATTERNS = [
-		('experiment_type', 'Experiment Type:.*(Emission|Excitation)].*'),
-		('park', 'Park: (\\d+)'),
-		('integration_time', 'Integration Time: %ss' % FLOAT_PATTERN),
-		('excitation_slit', 'Excitation' + SLIT_PATTERN),
-		('emission_slit', 'Emission' + SLIT_PATTERN),
-	]
-
-	parameters = {}
-
-	for key, pattern in PATTERNS:
-		get_parameter(pattern, key, text, parameters)
-
-	return Parameters(**parameters)
-
-def rename_pages(folder : PyOrigin.CPyFolder) -> None:
-	for pagebase in folder.PageBases():
-		if pagebase.Type != PyOrigin.PGTYPE_WKS: # ignore non-worksheets
+from note_parser import NoteRecord, add_duplicate_suffixes, build_long_name
+from note_cache import NoteCache
+from master_sheets import PROJECT_OPTION, PageInfo, get_creation_dates, is_valid_page, read_pages, walk_folders
+
+
+def read_note(short_name : str) -> Optional[str]:
+	note = PyOrigin.Pages(short_name).Layers('Note')
+	if note is None:
+		print('this page does not have a Note sheet')
+		return None
+	return note.Columns(0).GetData()[0]
+
+
+def rename_pages(folder_name : str, pages : List[PageInfo], cache : NoteCache) -> Tuple[Dict[str, Tuple[str, NoteRecord]], int]:
+	"""
+	Renames the worksheets from their Note, each Note is read and parsed once.
+	Returns {short name : (long name, parsed Note)} for every worksheet with a complete Note,
+	and how many worksheets were actually renamed.
+	"""
+	renamed = 0
+	parsed = [] # (page, note hash, parsed Note)
+	new_names = [] # (creation date, new long name)
+
+	for page in pages:
+		print('working on page: ' + page.name)
+
+		text = read_note(page.name)
+		if text is None:
 			continue
 
-		short_name = pagebase.GetName()
-		print('working on page: ' + short_name)
-
-		note = PyOrigin.Pages(short_name).Layers('Note')
-		if note is None:
-			print('this page does not have a Note sheet')
-			continue
-
-		text = note.Columns(0).GetData()[0]
-
+		(key, record) = cache.parse(text)
 		try:
-			parameters = parse_experiment(text)
+			parameters = record.check()
 		except KeyError as error:
 			print(error)
+			print('The worksheet was not renamed.')
+			continue
 
 		print(parameters)
 
+		parsed.append((page, key, parameters))
+		new_names.append((page.creation_date, build_long_name(folder_name, parameters)))
+
+	names = {}
+	for (page, key, parameters), new_name in zip(parsed, add_duplicate_suffixes(new_names)):
+		names[page.name] = (new_name, parameters)
+		if page.long_name == new_name and cache.is_renamed(page.name, key, new_name):
+			continue
+
+		print('renaming: old name = %s, new name = %s' % (page.long_name, new_name))
+		PyOrigin.Pages(page.name).SetLongName(new_name)
+		cache.set_renamed(page.name, key, new_name)
+		renamed += 1
+
+	return (names, renamed)
+
+
+def rename_folder(folder : PyOrigin.CPyFolder, cache : NoteCache, dates : Dict[str, datetime]) -> int:
+	"""
+	Renames the worksheets of the folder, returns how many were renamed.
+	"""
+	pages = [page for page in read_pages(folder, dates, with_layers = False) if is_valid_page(page)]
+	(_, renamed) = rename_pages(folder.GetName(), pages, cache)
+	return renamed
+
+
+def main(arguments : List[str]):
+	# --project: every folder of the project instead of the active one
+	project = PROJECT_OPTION in arguments
+	folders = walk_folders(PyOrigin.GetRootFolder()) if project else [PyOrigin.ActiveFolder()]
+	dates = get_creation_dates(folders) # in a single call for all the folders
 
-def main():
-	folder = PyOrigin.ActiveFolder()
-	print('\n\ncurrent folder: ' + folder.Path() + '\n\n')
+	cache = NoteCache.for_project()
+	summary = []
+	for folder in folders:
+		path = folder.Path()
+		print('\n\ncurrent folder: ' + path + '\n\n')
+		summary.append((path, rename_folder(folder, cache, dates)))
+	cache.save()
 
-	rename_pages(folder)
+	if project:
+		print('\n\nsummary: %d folders' % len(summary))
+		for path, renamed in summary:
+			print('%-40s %d worksheets renamed' % (path, renamed))
 
 
 if __name__ == '__main__':
-	main()
\ No newline at end of file
+	main(sys.argv[1:])
@@ -0,0 +1,141 @@
+"""
+note_parser.parse_note against extract_parameters() in rename_files.c: the long names below are those that
+rename_files.c gives to the pages of the folder TN76_DCM (None: the page is not renamed).
+
+	python -m unittest discover tests
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from note_parser import build_long_name, parse_note
+
+FOLDER_NAME = 'TN76_DCM'
+
+EXPERIMENT_FILE = (
+	'<EXPERIMENT><general expFileVersion="3.0" comment="Spectral Acquisition[Emission]" />'
+	'<Correction><SCD1 darkEnabled="-1" blankEnabled="0" blankFile="" correctionEnabled="-1" />'
+	'<SCD2 darkEnabled="1" blankEnabled="0" blankFile="" correctionEnabled="0" /></Correction>'
+	'<ExpAxis><Axis Index="1" AxisType="1" Units="3" IsEven="-1" Increment="1" Begin="370" End="700">'
+	'</Axis></ExpAxis></EXPERIMENT>'
+)
+
+# as FluorEssence writes it (CRLF line endings)
+EMISSION_NOTE = '\r\n'.join([
+	'Experiment Type: Spectral Acquisition[Emission]',
+	'Integration Time: 0.1s',
+	'Park: 350nm',
+	'Increment: 1nm',
+	'EX1: Excitation 1',
+	'Side Entrance Slit: 2 nmBandpass',
+	'Side Exit Slit: 2 nmBandpass',
+	'EM1: Emission 1',
+	'Side Entrance Slit: 1 nmBandpass',
+	'Side Exit Slit: 1 nmBandpass',
+	'[EXP_FILE]',
+	EXPERIMENT_FILE,
+])
+
+
+
+def note(*lines : str) -> str:
+	return '\r\n'.join(lines)
+
+
+
+def long_name(text : str):
+	"""
+	The long name rename_files.c gives to a page with this Note, None if it throws (a parameter is missing).
+	"""
+	try:
+		return build_long_name(FOLDER_NAME, parse_note(text).check())
+	except KeyError:
+		return None
+
+
+
+class ParseNoteTest(unittest.TestCase):
+
+	def test_emission(self):
+		self.assertEqual(long_name(EMISSION_NOTE), 'TN76_DCM_350_2_1_0.1')
+
+		record = parse_note(EMISSION_NOTE)
+		self.assertEqual(record.range, (370.0, 700.0))
+		self.assertEqual(record.correction['SCD1'].dark, '-1')
+		self.assertEqual(record.correction['SCD2'].correction, '0')
+
+	def test_excitation(self):
+		# the slits are those of the monochromator of the last EX1/EM1 header, in any order
+		text = note(
+			'Experiment Type: Spectral Acquisition[Excitation]',
+			'Integration Time: 1s',
+			'Park: 520nm',
+			'EM1: Emission 1',
+			'Side Entrance Slit: 5 nmBandpass',
+			'EX1: Excitation 1',
+			'Side Entrance Slit: 1.5 nmBandpass',
+		)
+		self.assertEqual(long_name(text), 'Ex_TN76_DCM_520_1.5_5_1')
+
+	def test_number_formats(self):
+		# %.0f for the park, one decimal (rounded half to even) for the others when they have decimals
+		text = note(
+			'Experiment Type: Spectral Acquisition[Emission]',
+			'Integration Time: 0.25s',
+			'Park: 349.6nm',
+			'EX1: Excitation 1',
+			'Side Entrance Slit: 2.0 nmBandpass',
+			'EM1: Emission 1',
+			'Side Entrance Slit: .5 nmBandpass',
+		)
+		self.assertEqual(long_name(text), 'TN76_DCM_350_2_0.5_0.2')
+
+	def test_other_types_are_excitations(self):
+		text = EMISSION_NOTE.replace('Spectral Acquisition[Emission]', 'Spectral Acquisition[Synchronous]')
+		self.assertEqual(long_name(text), 'Ex_TN76_DCM_350_2_1_0.1')
+
+	def test_experiment_type_needs_spectral_acquisition(self):
+		text = EMISSION_NOTE.replace('Spectral Acquisition[Emission]', 'Kinetics[Emission]')
+		self.assertIsNone(parse_note(text).experiment_type)
+		self.assertIsNone(long_name(text))
+
+	def test_prefixes_ignore_the_case_but_not_the_values(self):
+		# is_str_match_begin ignores the case, the sscanf formats do not
+		self.assertIsNone(long_name(EMISSION_NOTE.replace('Integration Time:', 'Integration time:')))
+		self.assertIsNone(long_name(EMISSION_NOTE.replace('Park: 350nm', 'PARK: 350nm')))
+
+		# "EM1: EMISSION" still selects the emission slit
+		text = EMISSION_NOTE.replace('EM1: Emission 1', 'EM1: EMISSION 1')
+		self.assertEqual(long_name(text), 'TN76_DCM_350_2_1_0.1')
+
+	def test_last_value_wins(self):
+		text = EMISSION_NOTE.replace('Park: 350nm', 'Park: 350nm\r\nPark: 360nm\r\nPark: ?nm')
+		self.assertEqual(long_name(text), 'TN76_DCM_360_2_1_0.1')
+
+	def test_lines_after_the_experiment_file(self):
+		self.assertEqual(long_name(EMISSION_NOTE + '\r\nPark: 400nm'), 'TN76_DCM_400_2_1_0.1')
+
+	def test_missing_parameters(self):
+		for line in ('Experiment Type:', 'Integration Time:', 'Park:', 'Side Entrance Slit: 1 '):
+			lines = [text for text in EMISSION_NOTE.split('\r\n') if not text.startswith(line)]
+			self.assertIsNone(long_name('\r\n'.join(lines)), line)
+
+	def test_slit_before_any_header(self):
+		# the monochromator is unknown, the slit is not read
+		text = note(
+			'Experiment Type: Spectral Acquisition[Emission]',
+			'Integration Time: 0.1s',
+			'Park: 350nm',
+			'Side Entrance Slit: 2 nmBandpass',
+			'EM1: Emission 1',
+			'Side Entrance Slit: 1 nmBandpass',
+		)
+		self.assertIsNone(parse_note(text).excitation_slit)
+
+
+
+if __name__ == '__main__':
+	unittest.main()
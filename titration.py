@@ -0,0 +1,390 @@
+"""
+Global analysis of the titrations stacked in the STACK masters (TITRATION and BATCH modes of master_sheets.py).
+
+A STACK master is read as one (wavelength x titration point) matrix, the points being its columns in the order
+of their creation, and every wavelength is analyzed at once:
+
+	SVD        the first singular values and components (spectra, and their profiles along the titration):
+	           the number of significant components is the number of species contributing to the spectra
+	1:1 fit    a binding isotherm fitted globally: the dissociation constant Kd is shared by the wavelengths,
+	           the signal of the free host (F0) and its change at saturation (dF) are those of each wavelength
+
+For a given Kd, F0 and dF are a linear least squares problem with a closed form solution: the residuals
+of every wavelength are computed for a whole grid of Kd in a few matrix products, and the grid is refined
+around its best Kd. Only the wavelengths where every point has data are analyzed.
+
+The titrant concentrations of the points are given by --concentrations=0,0.5,1,..., otherwise the points
+are taken as equal additions of titrant (0, 1, 2...). With --host=C (total concentration of the host, in the
+same unit) the depletion of the titrant is accounted for (quadratic isotherm), otherwise the titrant is
+taken to be in excess (hyperbolic isotherm).
+
+The results are written to a FIT_ sheet next to the master (FIT_STACK_TN76_DCM), as three tables side by side:
+the wavelengths (F0, dF, residuals, SVD spectra), the points (fraction bound, observed and fitted signals at the
+wavelength of largest response, residuals, SVD profiles) and the parameters (Kd, goodness of fit).
+A STACK master holding several series (Emission and Excitation, several parks) is analyzed on its largest one.
+
+usage (see master_sheets_titration.ogs, [Analysis]):
+	titration.py                                               every STACK master of the project
+	titration.py --master=STACK_TN76_DCM --concentrations=0,1,2,5,10 --host=2 --components=3
+"""
+
+from __future__ import annotations
+import csv
+import re
+import sys
+from collections import namedtuple
+from typing import List, Optional, Tuple
+import numpy as np
+import profiling
+import master_sheets
+from master_export import to_grid
+from master_sheets import (
+	Column, ExpType, MasterSheet, OriginBackend,
+	PREFIX_BATCH, PREFIX_FIT, PROFILE_OPTION, X_END, X_NAME, X_START, X_UNIT, Y_BASE_UNIT,
+)
+from note_parser import parse_long_name
+try:
+	import PyOrigin
+	from PyOrigin import CPyWorksheet
+except ImportError: # headless.py --titration
+	PyOrigin = None
+
+# arguments of the .ogs launcher: a single master instead of every STACK master of the project,
+# the titrant concentrations of the points, the total concentration of the host, the number of SVD components
+MASTER_OPTION         = '--master'
+CONCENTRATIONS_OPTION = '--concentrations'
+HOST_OPTION           = '--host'
+COMPONENTS_OPTION     = '--components'
+
+DEFAULT_COMPONENTS = 3
+
+# Kd is searched from KD_RANGE times below the smallest concentration to KD_RANGE times above the largest,
+# on a grid of KD_GRID_SIZE values (evenly spaced in log) refined KD_REFINEMENTS times around its best value
+KD_RANGE = 100
+KD_GRID_SIZE = 200
+KD_REFINEMENTS = 3
+# step (in log10 Kd) of the finite differences giving the error of Kd
+LOG_KD_STEP = 1e-3
+
+# a column of the results sheet
+ResultColumn = namedtuple('ResultColumn', ['long_name', 'units', 'comments', 'designation', 'values'])
+
+BindingFit = namedtuple('BindingFit', ['kd', 'log_kd_error', 'at_edge', 'f0', 'delta', 'fraction', 'fitted'])
+
+
+
+def parse_concentrations(string : str) -> np.ndarray:
+	"""
+	"0 0.5, 1" -> [0, 0.5, 1]
+	"""
+	return np.array([float(field) for field in re.split('[\\s,;]+', string.strip()) if field != ''])
+
+
+
+def describe_series(key : Optional[Tuple[str, float]]) -> str:
+	return '%s at %g nm' % key if key is not None else 'long names without parameters'
+
+
+
+def select_series(columns : List[Column]) -> Tuple[Optional[Tuple[str, float]], List[Column]]:
+	"""
+	The largest series of the columns: same experiment type and park (parsed from their long names),
+	((experiment type, park) or None if the long names cannot be parsed, columns)
+	"""
+	series = {}
+	for column in columns:
+		parameters = parse_long_name(column.long_name)
+		series.setdefault(parameters[:2] if parameters is not None else None, []).append(column)
+
+	key = max(series, key = lambda key : len(series[key])) # the first one for equal sizes
+	for other, left_out in series.items():
+		if other != key:
+			print('%d columns (%s) are not part of the series analyzed (%s), they are left out' %
+				(len(left_out), describe_series(other), describe_series(key))
+			)
+	return (key, series[key])
+
+
+
+def bound_fraction(concentrations : np.ndarray, kds : np.ndarray, host : Optional[float]) -> np.ndarray:
+	"""
+	Fraction of the host bound at the titrant concentrations, one row per Kd.
+	"""
+	g = concentrations[np.newaxis, :]
+	kd = kds[:, np.newaxis]
+	if host is None:
+		return g / (kd + g)
+
+	# smaller root of host f^2 - (host + g + kd) f + g = 0, written so that it does not cancel out
+	b = host + g + kd
+	return 2 * g / (b + np.sqrt(np.maximum(b * b - 4 * host * g, 0)))
+
+
+
+def profile_rss(fractions : np.ndarray, centered : np.ndarray, total : float) -> np.ndarray:
+	"""
+	Residual sum of squares of the best F0 and dF of every wavelength, for each row of fractions (one per Kd).
+	centered: the spectra (one row per wavelength) minus their mean over the points, total: their sum of squares.
+	"""
+	deviations = fractions - fractions.mean(axis = 1, keepdims = True)
+	squares = (deviations ** 2).sum(axis = 1)
+	# explained sum of squares of the regressions of every wavelength on the fraction, for every Kd at once
+	with np.errstate(invalid = 'ignore', divide = 'ignore'):
+		rss = total - ((deviations @ centered.T) ** 2).sum(axis = 1) / squares
+	# a constant fraction (Kd far out of the titration) explains nothing
+	rss[squares == 0] = total
+	return rss
+
+
+
+def fit_binding(spectra : np.ndarray, concentrations : np.ndarray, host : Optional[float]) -> BindingFit:
+	"""
+	Global 1:1 fit of the spectra (one row per wavelength, one column per point).
+	"""
+	mean = spectra.mean(axis = 1, keepdims = True)
+	centered = spectra - mean
+	total = float((centered ** 2).sum())
+
+	positive = concentrations[concentrations > 0]
+	if len(positive) == 0:
+		raise ValueError('no titrant was added (all the concentrations are 0)')
+	log_kds = np.linspace(np.log10(positive.min() / KD_RANGE), np.log10(positive.max() * KD_RANGE), KD_GRID_SIZE)
+
+	for refinement in range(KD_REFINEMENTS + 1):
+		rss = profile_rss(bound_fraction(concentrations, 10 ** log_kds, host), centered, total)
+		best = int(np.argmin(rss))
+		if refinement == 0:
+			at_edge = best == 0 or best == len(log_kds) - 1
+		log_kd = log_kds[best]
+		step = log_kds[1] - log_kds[0]
+		log_kds = np.linspace(log_kd - step, log_kd + step, KD_GRID_SIZE)
+
+	# error of log10 Kd from the curvature of the residuals: variance = 2 sigma^2 / rss''
+	(below, at, above) = profile_rss(
+		bound_fraction(concentrations, 10 ** (log_kd + LOG_KD_STEP * np.array([-1, 0, 1])), host), centered, total
+	)
+	curvature = (below - 2 * at + above) / LOG_KD_STEP ** 2
+	freedom = spectra.size - (2 * len(spectra) + 1)
+	log_kd_error = np.sqrt(2 * at / freedom / curvature) if freedom > 0 and curvature > 0 else np.nan
+
+	# F0 and dF of every wavelength at the best Kd
+	fraction = bound_fraction(concentrations, np.array([10 ** log_kd]), host)[0]
+	deviation = fraction - fraction.mean()
+	delta = centered @ deviation / (deviation @ deviation)
+	f0 = mean[:, 0] - delta * fraction.mean()
+	fitted = f0[:, np.newaxis] + delta[:, np.newaxis] * fraction[np.newaxis, :]
+
+	return BindingFit(10 ** log_kd, log_kd_error, at_edge, f0, delta, fraction, fitted)
+
+
+
+def svd_components(spectra : np.ndarray, count : int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+	"""
+	(all the singular values, first count spectra (one column each), their profiles along the titration
+	scaled by the singular values) of the spectra (one row per wavelength).
+	"""
+	(u, s, vt) = np.linalg.svd(spectra, full_matrices = False)
+	count = min(count, len(s))
+	# the sign of a component is arbitrary: its spectrum is made positive where it is the largest
+	signs = np.sign(u[np.abs(u[:, :count]).argmax(axis = 0), np.arange(count)])
+	signs[signs == 0] = 1
+	return (s, u[:, :count] * signs, vt[:count].T * (s[:count] * signs))
+
+
+
+def analyze(columns : List[Column], concentrations : Optional[np.ndarray], host : Optional[float], components : int) -> List[ResultColumn]:
+	"""
+	The results sheet of the titration whose points are the columns (master_sheets.Column), in order.
+	Raises a ValueError if it cannot be analyzed.
+	"""
+	if len(columns) < 3:
+		raise ValueError('a titration needs at least 3 points, there are %d' % len(columns))
+
+	wavelengths = master_sheets.grid_wavelengths()
+	matrix = to_grid(columns, X_START, X_END, master_sheets.X_STEP).T # (wavelength, point)
+	complete = ~np.isnan(matrix).any(axis = 1)
+	if not complete.any():
+		raise ValueError('the spectra of the titration have no wavelength in common')
+	spectra = matrix[complete]
+
+	concentrations_comment = 'titrant'
+	if concentrations is None:
+		concentrations = np.arange(len(columns), dtype = float)
+		concentrations_comment = 'titrant, in equal additions'
+	elif len(concentrations) != len(columns):
+		raise ValueError('%d concentrations were given for %d titration points' % (len(concentrations), len(columns)))
+
+	fit = fit_binding(spectra, concentrations, host)
+	(singular_values, svd_spectra, svd_profiles) = svd_components(spectra, components)
+
+	residuals = spectra - fit.fitted
+	rss = float((residuals ** 2).sum())
+	r2 = 1 - rss / float(((spectra - spectra.mean()) ** 2).sum())
+	explained = singular_values ** 2 / (singular_values ** 2).sum()
+	# the isotherm is shown at the wavelength where the signal changes the most
+	largest = int(np.abs(fit.delta).argmax())
+	largest_wavelength = wavelengths[complete][largest]
+
+	if fit.at_edge:
+		print('warning: Kd is at the edge of the range searched, the titration does not determine it')
+	print('Kd = %.4g (log10 Kd = %.3f +- %.3f), R2 = %.5f over %d wavelengths, SVD explained: %s' % (
+		fit.kd, np.log10(fit.kd), fit.log_kd_error, r2, len(spectra),
+		', '.join('%.4f' % value for value in explained[:len(svd_profiles[0])])
+	))
+
+	def on_grid(values : np.ndarray) -> np.ndarray:
+		rows = np.full(len(wavelengths), np.nan)
+		rows[complete] = values
+		return rows
+
+	results = [
+		ResultColumn(X_NAME,         X_UNIT,      '',                              'X', wavelengths),
+		ResultColumn('F0',           Y_BASE_UNIT, 'free host',                     'Y', on_grid(fit.f0)),
+		ResultColumn('dF',           Y_BASE_UNIT, 'change at saturation',          'Y', on_grid(fit.delta)),
+		ResultColumn('RMS residual', Y_BASE_UNIT, 'over the points',               'Y', on_grid(np.sqrt((residuals ** 2).mean(axis = 1)))),
+	]
+	results += [
+		ResultColumn('SVD spectrum %d' % (i + 1), '', 'singular value %.4g' % singular_values[i], 'Y', on_grid(svd_spectra[:, i]))
+		for i in range(svd_spectra.shape[1])
+	]
+	results += [
+		ResultColumn('Concentration',  '',          concentrations_comment,          'X', concentrations),
+		ResultColumn('Fraction bound', '',          '',                              'Y', fit.fraction),
+		ResultColumn('Observed',       Y_BASE_UNIT, 'at %g nm' % largest_wavelength, 'Y', spectra[largest]),
+		ResultColumn('Fitted',         Y_BASE_UNIT, 'at %g nm' % largest_wavelength, 'Y', fit.fitted[largest]),
+		ResultColumn('RMS residual',   Y_BASE_UNIT, 'over the wavelengths',          'Y', np.sqrt((residuals ** 2).mean(axis = 0))),
+	]
+	results += [
+		ResultColumn('SVD profile %d' % (i + 1), '', '', 'Y', svd_profiles[:, i])
+		for i in range(svd_profiles.shape[1])
+	]
+
+	parameters = [
+		('Kd',                 fit.kd),
+		('log10 Kd',           np.log10(fit.kd)),
+		('log10 Kd error',     fit.log_kd_error),
+		('Kd determined',      0.0 if fit.at_edge else 1.0),
+		('host',               host if host is not None else np.nan),
+		('points',             float(len(columns))),
+		('wavelengths',        float(len(spectra))),
+		('RMS residual',       np.sqrt(rss / spectra.size)),
+		('R2',                 r2),
+	] + [('SVD explained %d' % (i + 1), explained[i]) for i in range(svd_spectra.shape[1])]
+	results += [
+		ResultColumn('Parameter', '', '',                                     'N', [name for name, _ in parameters]),
+		ResultColumn('Value',     '', 'Kd in the unit of the concentrations', 'N', np.array([value for _, value in parameters])),
+	]
+	return results
+
+
+
+def analyze_master(master_sheet : MasterSheet, concentrations : Optional[np.ndarray], host : Optional[float], components : int) -> Tuple[ExpType, List[ResultColumn]]:
+	"""
+	(experiment type of the series analyzed, results sheet) of a STACK master.
+	"""
+	(key, columns) = select_series(master_sheet.read(1))
+	print('%d titration points (%s)' % (len(columns), describe_series(key)))
+	with profiling.phase('analyze'):
+		results = analyze(columns, concentrations, host, components)
+	return (ExpType.from_note(key[0]) if key is not None else ExpType.EMISSION, results)
+
+
+
+def result_rows(results : List[ResultColumn]) -> List[list]:
+	"""
+	The columns of the results, all as long as the longest one (missing values are empty strings).
+	"""
+	rows_count = max(len(result.values) for result in results)
+	block = []
+	for result in results:
+		values = [value if isinstance(value, str) or np.isfinite(value) else '' for value in np.asarray(result.values).tolist()]
+		block.append(values + [''] * (rows_count - len(values)))
+	return block
+
+
+
+def write_results(worksheet : CPyWorksheet, results : List[ResultColumn]) -> None:
+	# the columns of a previous analysis are dropped first: it may have had more rows (components, concentrations)
+	worksheet.SetColCount(0)
+	worksheet.SetColCount(len(results))
+	worksheet.SetData(result_rows(results), 0, 0)
+	worksheet.SetColDesignations(''.join(result.designation for result in results), 0, False)
+	worksheet.SetLabels([result.long_name for result in results], 'L', 0)
+	worksheet.SetLabels([result.units for result in results],     'U', 0)
+	worksheet.SetLabels([result.comments for result in results],  'C', 0)
+
+
+
+def write_results_csv(path : str, results : List[ResultColumn]) -> None:
+	"""
+	The results sheet as a CSV file (headless.py): long names, units and comments rows, then the data.
+	"""
+	with open(path, mode = 'w', newline = '') as f:
+		writer = csv.writer(f)
+		writer.writerow([result.long_name for result in results])
+		writer.writerow([result.units for result in results])
+		writer.writerow([result.comments for result in results])
+		writer.writerows(zip(*result_rows(results)))
+
+
+
+def option_value(arguments : List[str], option : str) -> Optional[str]:
+	argument = next((argument for argument in arguments if argument.startswith(option)), None)
+	return argument.partition('=')[2] if argument is not None else None
+
+
+
+def run(arguments : List[str]) -> None:
+	"""
+	Analyzes the STACK masters of the project with the arguments of the .ogs launcher.
+	"""
+	# the .ogs launcher passes empty strings for the options that are not set
+	arguments = [argument for argument in arguments if argument != '']
+
+	profile = option_value(arguments, PROFILE_OPTION)
+	if profile is not None:
+		profiling.enable(PyOrigin)
+
+	master = option_value(arguments, MASTER_OPTION)
+	concentrations = option_value(arguments, CONCENTRATIONS_OPTION)
+	concentrations = parse_concentrations(concentrations) if concentrations else None
+	host = option_value(arguments, HOST_OPTION)
+	host = float(host) if host else None
+	components = int(option_value(arguments, COMPONENTS_OPTION) or DEFAULT_COMPONENTS)
+
+	try:
+		backend = OriginBackend()
+		long_names = backend.master_names(PREFIX_BATCH)
+		if master:
+			if master not in long_names:
+				print('error: there is no master %s in the root of the project' % master)
+				return
+			long_names = [master]
+
+		for long_name in long_names:
+			print('=' * 80)
+			print('analyzing:\t' + long_name)
+			print('=' * 80)
+			# the masters exist: the experiment type and prefix are only used to name new sheets
+			prefix = long_name[len(PREFIX_BATCH) + 1:]
+			try:
+				(exp_type, results) = analyze_master(backend.open_master(ExpType.EMISSION, prefix, long_name), concentrations, host, components)
+			except ValueError as error:
+				print('error: %s is not analyzed: %s' % (long_name, error))
+				continue
+
+			with profiling.phase('write_results'):
+				fit_sheet = backend.open_master(exp_type, PREFIX_FIT + prefix, PREFIX_FIT + '_' + long_name)
+				write_results(fit_sheet.worksheet, results)
+			print('\n')
+		backend.close()
+
+		if profile is not None:
+			profiling.report(profile)
+	finally:
+		profiling.disable()
+
+
+
+if __name__ == '__main__':
+	run(sys.argv[1:])